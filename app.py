@@ -1,14 +1,21 @@
 import os
+import uuid
 import logging
 import json
 from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from utils.tts import generate_speech
-from utils.lip_sync import generate_lip_sync
-from utils.video_processor import process_video
+from utils.jobs import run_export_job, run_preview_job
+from utils.batch import run_batch_job, validate_batch_items
+from utils.offload import run_in_process, is_async_mode
+from utils.scheduler import JobScheduler, estimate_job_cost, PREVIEW_LANE, EXPORT_LANE
+from utils.broker import create_broker, relay_progress, LocalBroker
+from utils.worker import run_worker
+from utils.warmup import warm_up
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; set LOG_LEVEL=DEBUG and ENGINEIO_LOGGER=1 to trace
+# individual Socket.IO packets
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
@@ -19,12 +26,40 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 socketio = SocketIO(
     app, 
     cors_allowed_origins="*", 
-    async_mode='threading',
+    async_mode='eventlet' if is_async_mode() else 'threading',
     ping_timeout=60,
     ping_interval=25,
-    engineio_logger=True  # Enable engine logging for debugging
+    engineio_logger=os.environ.get("ENGINEIO_LOGGER") == "1"
 )
 
+# With a job broker, renders run in separate worker processes (run_worker.py)
+# and any web process relays their progress to its own clients. Without one,
+# renders run in this process.
+JOB_BROKER_URL = os.environ.get("JOB_BROKER_URL")
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+MAX_JOBS_PER_CLIENT = int(os.environ.get("MAX_JOBS_PER_CLIENT", 2))
+
+if JOB_BROKER_URL:
+    broker = create_broker(JOB_BROKER_URL, max_jobs_per_client=MAX_JOBS_PER_CLIENT)
+    scheduler = None
+    socketio.start_background_task(relay_progress, broker, socketio.emit)
+    # No other process can reach a local broker, so this one runs its jobs
+    if isinstance(broker, LocalBroker):
+        socketio.start_background_task(run_worker, broker, RENDER_WORKERS)
+else:
+    broker = None
+    # Schedule renders so long exports cannot starve previews
+    scheduler = JobScheduler(
+        workers=RENDER_WORKERS,
+        preview_workers=int(os.environ.get("PREVIEW_WORKERS", 1)),
+        max_jobs_per_client=MAX_JOBS_PER_CLIENT
+    )
+
+# Heavy render modules are imported lazily; WARM_UP=1 pays that cost, and
+# preloads avatars and caches, in the background as soon as the worker starts
+if os.environ.get("WARM_UP") == "1":
+    socketio.start_background_task(warm_up)
+
 # Routes
 @app.route('/')
 def index():
@@ -56,7 +91,7 @@ def tts_endpoint():
             return jsonify({"error": "Text is required"}), 400
         
         # Generate speech using Edge TTS
-        audio_path = generate_speech(text, voice)
+        audio_path = run_in_process(generate_speech, text, voice)
         
         return jsonify({
             "success": True,
@@ -73,41 +108,108 @@ def generate_video_endpoint():
         text = data.get('text', '')
         avatar_id = data.get('avatar_id', '')
         voice = data.get('voice', 'en-US-AriaNeural')
+        room = data.get('client_id')
         
         if not text or not avatar_id:
             return jsonify({"error": "Text and avatar ID are required"}), 400
         
-        # Emit starting event via SocketIO
-        socketio.emit('processing_update', {'status': 'started', 'message': 'Starting video generation'})
+        cost = estimate_job_cost(text, voice, profile='export')
         
-        # 1. Generate speech
-        socketio.emit('processing_update', {'status': 'in_progress', 'message': 'Generating speech', 'progress': 25})
-        audio_path = generate_speech(text, voice)
+        if broker:
+            # Hand the job to a worker process; progress arrives over SocketIO
+            job_id = broker.push_job(
+                {'kind': 'export', 'room': room, 'text': text, 'avatar_id': avatar_id, 'voice': voice},
+                lane=EXPORT_LANE,
+                cost=cost,
+                client_id=room or request.remote_addr
+            )
+            broker.publish(room, 'processing_update', {'status': 'queued', 'message': 'Waiting for a free worker', 'job_id': job_id})
+            
+            return jsonify({
+                "success": True,
+                "job_id": job_id
+            }), 202
         
-        # 2. Generate lip sync
-        socketio.emit('processing_update', {'status': 'in_progress', 'message': 'Synchronizing lips', 'progress': 50})
-        lip_sync_result = generate_lip_sync(audio_path, avatar_id)
+        def send(event, update):
+            socketio.emit(event, update, to=room)
         
-        # 3. Process final video
-        socketio.emit('processing_update', {'status': 'in_progress', 'message': 'Finalizing video', 'progress': 75})
-        video_path = process_video(lip_sync_result, avatar_id)
-        
-        # 4. Complete
-        socketio.emit('processing_update', {'status': 'completed', 'message': 'Video ready', 'progress': 100, 'video_path': video_path})
+        job = scheduler.submit(
+            lambda: run_export_job(text, avatar_id, voice, send),
+            lane=EXPORT_LANE,
+            client_id=room or request.remote_addr,
+            cost=cost,
+            on_event=lambda event: send('processing_update', event)
+        )
+        result = job.result()
         
         return jsonify({
             "success": True,
-            "video_path": video_path
+            "video_path": result['video_path'],
+            "poster_path": result['poster_path'],
+            "poster_webp_path": result['poster_webp_path'],
+            "strip_path": result['strip_path'],
+            "segments": result['segments'],
+            "rendered_segments": result['rendered_segments']
         })
     except Exception as e:
+        # Failures inside the job have already been reported over SocketIO
         logger.error(f"Video generation error: {e}")
-        socketio.emit('processing_update', {'status': 'error', 'message': f'Error: {str(e)}'})
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/generate-batch', methods=['POST'])
+def generate_batch_endpoint():
+    try:
+        data = request.json
+        room = data.get('client_id')
+        make_zip = bool(data.get('zip', False))
+        
+        try:
+            items = validate_batch_items(data.get('items'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        batch_id = str(uuid.uuid4())
+        
+        if broker:
+            broker.push_job(
+                {'kind': 'batch', 'room': room, 'batch_id': batch_id, 'items': items, 'zip': make_zip},
+                lane=EXPORT_LANE,
+                cost=sum(estimate_job_cost(item['text'], item['voice']) for item in items),
+                client_id=room or request.remote_addr
+            )
+        else:
+            def send(event, update):
+                socketio.emit(event, update, to=room)
+            
+            # The batch's work is capped under its submitter's batch key: a
+            # batch does not eat into the client's own export slots, but one
+            # client's batches together never hold more than the cap
+            client_key = f"batch:{room or request.remote_addr}"
+            
+            def submit(fn, cost):
+                return scheduler.submit(fn, lane=EXPORT_LANE, client_id=client_key, cost=cost)
+            
+            socketio.start_background_task(run_batch_job, batch_id, items, send, submit, make_zip)
+        
+        # Per-item results arrive as 'batch_update' events
+        return jsonify({
+            "success": True,
+            "batch_id": batch_id,
+            "total": len(items)
+        }), 202
+    except Exception as e:
+        logger.error(f"Batch generation error: {e}")
         return jsonify({"error": str(e)}), 500
 
 # SocketIO events
 @socketio.on('connect')
 def handle_connect():
     logger.info("Client connected")
+    # Progress for this client's jobs is addressed to a room named after it,
+    # whichever process runs the job
+    client_id = request.args.get('client_id')
+    if client_id:
+        join_room(client_id)
     emit('connection_response', {'data': 'Connected'})
 
 @socketio.on('disconnect')
@@ -128,36 +230,29 @@ def handle_preview_request(data):
             })
             return
         
-        # Start processing the preview
-        emit('preview_update', {
-            'status': 'in_progress',
-            'message': 'Generating speech...'
-        })
-        
-        # 1. Generate speech (use shorter version of the text for preview)
-        preview_text = text[:100] + ('...' if len(text) > 100 else '')
-        audio_path = generate_speech(preview_text, voice)
+        # Events are emitted from a worker, outside this request
+        sid = request.sid
+        cost = estimate_job_cost(text[:100], voice, profile='preview')
         
-        emit('preview_update', {
-            'status': 'in_progress',
-            'message': 'Creating preview animation...',
-            'progress': 50
-        })
+        if broker:
+            broker.push_job(
+                {'kind': 'preview', 'room': sid, 'text': text, 'avatar_id': avatar_id, 'voice': voice},
+                lane=PREVIEW_LANE,
+                cost=cost,
+                client_id=data.get('client_id') or sid
+            )
+            return
         
-        # 2. Generate a simplified lip sync for preview
-        # This could be a shorter or lower-quality version for faster preview
-        lip_sync_path = generate_lip_sync(audio_path, avatar_id)
+        def send(event, update):
+            socketio.emit(event, update, to=sid)
         
-        # 3. Send the completed preview update
-        emit('preview_update', {
-            'status': 'completed',
-            'message': 'Preview ready',
-            'preview_data': {
-                'avatar_id': avatar_id,
-                'text': preview_text,
-                'preview_url': lip_sync_path
-            }
-        })
+        scheduler.submit(
+            lambda: run_preview_job(text, avatar_id, voice, send),
+            lane=PREVIEW_LANE,
+            client_id=data.get('client_id') or sid,
+            cost=cost,
+            on_event=lambda event: send('preview_update', dict(event, status='in_progress'))
+        )
         
     except Exception as e:
         logger.error(f"Preview generation error: {e}")
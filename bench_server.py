@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+Server benchmarks
+
+load: API and Socket.IO latency while renders are in flight. Starts a
+server in the given mode, samples GET /api/avatars latency and Socket.IO
+connect time while idle and while several exports render, and counts
+disconnects of a long-lived client.
+
+    python bench_server.py load --mode async --renders 4
+    python bench_server.py load --mode threading --renders 4
+    python bench_server.py load --mode eventlet-inline --renders 4
+
+startup: time to import app, time until the server answers, and latency of
+the first and second render, with and without WARM_UP=1.
+
+    python bench_server.py startup --mode threading
+
+broker: end-to-end check of multi-process mode. Starts two web servers and
+one run_worker.py on a shared SQLite broker, connects a Socket.IO client to
+server A, posts an export to server B, and checks that the client receives
+queued, progress and completed events for it. Exits non-zero on failure.
+
+    python bench_server.py broker --synthetic-audio
+
+--synthetic-audio seeds the segment audio cache with tones so renders run
+without reaching the TTS service.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+import statistics
+import subprocess
+import requests
+import socketio
+
+SERVER_COMMANDS = {
+    "threading": "from app import app, socketio; socketio.run(app, port={port}, allow_unsafe_werkzeug=True)",
+    "async": "import eventlet; eventlet.monkey_patch(); from app import app, socketio; "
+             "from utils.offload import exit_on_sigterm; exit_on_sigterm(); socketio.run(app, port={port})",
+    # Monkey-patched but rendering inline, as run_eventlet.py did before async mode
+    "eventlet-inline": "import eventlet; eventlet.monkey_patch(); from app import app, socketio; socketio.run(app, port={port}, allow_unsafe_werkzeug=True)",
+}
+
+def start_server(mode, port, env=None):
+    """
+    Start the app in a child process and wait until it answers HTTP
+    """
+    env = dict(os.environ, **(env or {}))
+    if mode == "async":
+        env["SERVER_MODE"] = "async"
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER_COMMANDS[mode].format(port=port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/avatars", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.05)
+
+    process.terminate()
+    raise RuntimeError(f"Server did not start on port {port}")
+
+def start_worker(env):
+    """
+    Start run_worker.py in a child process
+    """
+    return subprocess.Popen(
+        [sys.executable, "run_worker.py"],
+        env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+def seed_synthetic_audio(sentence, voice):
+    """
+    Put a generated tone in the segment audio cache for a sentence
+    """
+    from utils.segments import SEGMENT_AUDIO_DIR, segment_audio_path
+
+    os.makedirs(SEGMENT_AUDIO_DIR, exist_ok=True)
+    audio_path = segment_audio_path(sentence, voice)
+    subprocess.run(
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", "sine=frequency=220:duration=3", audio_path],
+        check=True,
+        capture_output=True
+    )
+
+def summarize(samples):
+    if not samples:
+        return "no samples"
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"n={len(samples):4d}  p50={statistics.median(samples) * 1000:7.1f}ms  "
+        f"p95={p95 * 1000:7.1f}ms  max={max(samples) * 1000:7.1f}ms"
+    )
+
+class LatencySampler:
+    """
+    Samples API latency and Socket.IO connect time on background threads
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.api = []
+        self.connect = []
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._sample_api, daemon=True),
+            threading.Thread(target=self._sample_connect, daemon=True),
+        ]
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _sample_api(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            requests.get(f"{self.base_url}/api/avatars", timeout=120)
+            self.api.append(time.perf_counter() - start)
+            self._stop.wait(0.05)
+
+    def _sample_connect(self):
+        while not self._stop.is_set():
+            client = socketio.Client()
+            start = time.perf_counter()
+            client.connect(self.base_url, transports=["polling"], wait_timeout=120)
+            self.connect.append(time.perf_counter() - start)
+            client.disconnect()
+            self._stop.wait(0.5)
+
+def run_load(args):
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    voice = "en-US-AriaNeural"
+    run_id = uuid.uuid4().hex[:8]
+    scripts = [
+        f"Load test {run_id} render {i} first sentence. Load test {run_id} render {i} second sentence."
+        for i in range(args.renders)
+    ]
+
+    if args.synthetic_audio:
+        from utils.segments import split_sentences
+        for script in scripts:
+            for sentence in split_sentences(script):
+                seed_synthetic_audio(sentence, voice)
+
+    server = start_server(args.mode, port)
+    try:
+        disconnects = []
+        watcher = socketio.Client()
+        watcher.on("disconnect", lambda *a: disconnects.append(time.time()))
+        watcher.connect(base_url, transports=["polling"])
+
+        with LatencySampler(base_url) as idle:
+            time.sleep(args.idle_seconds)
+
+        render_times = []
+
+        def render(script):
+            start = time.perf_counter()
+            response = requests.post(
+                f"{base_url}/api/generate-video",
+                json={"text": script, "avatar_id": "avatar1", "voice": voice, "client_id": uuid.uuid4().hex},
+                timeout=600
+            )
+            response.raise_for_status()
+            render_times.append(time.perf_counter() - start)
+
+        with LatencySampler(base_url) as loaded:
+            renders = [threading.Thread(target=render, args=(script,)) for script in scripts]
+            for thread in renders:
+                thread.start()
+            for thread in renders:
+                thread.join()
+
+        watcher.disconnect()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"mode={args.mode} renders={args.renders}")
+    print(f"  idle   API      {summarize(idle.api)}")
+    print(f"  idle   connect  {summarize(idle.connect)}")
+    print(f"  loaded API      {summarize(loaded.api)}")
+    print(f"  loaded connect  {summarize(loaded.connect)}")
+    print(f"  renders         {summarize(render_times)}")
+    # The watcher disconnects once on purpose at the end
+    print(f"  unexpected disconnects: {len(disconnects) - 1}")
+
+def measure_import_time(repeats):
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return samples
+
+def run_startup(args):
+    voice = "en-US-AriaNeural"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"mode={args.mode}")
+    print(f"  import app          {summarize(measure_import_time(args.repeats))}")
+
+    for warm in (False, True):
+        run_id = uuid.uuid4().hex[:8]
+        scripts = [f"Startup test {run_id} request {i}." for i in range(2)]
+        if args.synthetic_audio:
+            for script in scripts:
+                seed_synthetic_audio(script, voice)
+
+        start = time.perf_counter()
+        server = start_server(args.mode, args.port, env={"WARM_UP": "1" if warm else "0"})
+        ready = time.perf_counter() - start
+        try:
+            if warm:
+                time.sleep(args.warm_up_wait)
+
+            latencies = []
+            for script in scripts:
+                request_start = time.perf_counter()
+                requests.post(
+                    f"{base_url}/api/generate-video",
+                    json={"text": script, "avatar_id": "avatar1", "voice": voice},
+                    timeout=600
+                ).raise_for_status()
+                latencies.append(time.perf_counter() - request_start)
+        finally:
+            server.terminate()
+            server.wait()
+
+        label = "warm" if warm else "cold"
+        print(f"  {label} ready          {ready * 1000:7.1f}ms")
+        print(f"  {label} first render   {latencies[0] * 1000:7.1f}ms")
+        print(f"  {label} second render  {latencies[1] * 1000:7.1f}ms")
+
+def run_broker(args):
+    voice = "en-US-AriaNeural"
+    run_id = uuid.uuid4().hex[:8]
+    script = f"Broker test {run_id} first sentence. Broker test {run_id} second sentence."
+    if args.synthetic_audio:
+        from utils.segments import split_sentences
+        for sentence in split_sentences(script):
+            seed_synthetic_audio(sentence, voice)
+
+    broker_path = os.path.join("temp", f"bench_broker_{run_id}.db")
+    env = {"JOB_BROKER_URL": f"sqlite:///{broker_path}"}
+    port_a, port_b = args.port, args.port + 1
+    processes = []
+    try:
+        processes.append(start_server("threading", port_a, env=env))
+        processes.append(start_server("threading", port_b, env=env))
+        processes.append(start_worker(env))
+
+        client_id = uuid.uuid4().hex
+        updates = []
+        finished = threading.Event()
+
+        def on_update(data):
+            updates.append(data)
+            if data.get("status") in ("completed", "error"):
+                finished.set()
+
+        client = socketio.Client()
+        client.on("processing_update", on_update)
+        client.connect(f"http://127.0.0.1:{port_a}?client_id={client_id}", transports=["polling"])
+
+        start = time.perf_counter()
+        response = requests.post(
+            f"http://127.0.0.1:{port_b}/api/generate-video",
+            json={"text": script, "avatar_id": "avatar1", "voice": voice, "client_id": client_id},
+            timeout=30
+        )
+        finished.wait(args.timeout)
+        elapsed = time.perf_counter() - start
+        client.disconnect()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(broker_path + suffix):
+                os.remove(broker_path + suffix)
+
+    statuses = [update.get("status") for update in updates]
+    print(f"POST to server B: HTTP {response.status_code}")
+    print(f"events on server A: {' -> '.join(statuses) or 'none'} ({elapsed:.1f}s)")
+
+    failures = []
+    if response.status_code != 202:
+        failures.append(f"expected HTTP 202, got {response.status_code}")
+    if not statuses or statuses[0] != "queued":
+        failures.append("first event was not 'queued'")
+    if "in_progress" not in statuses:
+        failures.append("no progress events")
+    if not statuses or statuses[-1] != "completed":
+        failures.append("last event was not 'completed'")
+    elif not updates[-1].get("video_path") or not os.path.exists(updates[-1]["video_path"]):
+        failures.append("completed event has no rendered video")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+def main():
+    parser = argparse.ArgumentParser(description="Server benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help="Latency while renders are in flight")
+    load.add_argument("--mode", choices=sorted(SERVER_COMMANDS), default="async")
+    load.add_argument("--renders", type=int, default=4)
+    load.add_argument("--port", type=int, default=5050)
+    load.add_argument("--idle-seconds", type=float, default=3.0)
+    load.add_argument("--synthetic-audio", action="store_true")
+    load.set_defaults(run=run_load)
+
+    startup = subparsers.add_parser("startup", help="Startup time and first-request latency")
+    startup.add_argument("--mode", choices=sorted(SERVER_COMMANDS), default="threading")
+    startup.add_argument("--port", type=int, default=5050)
+    startup.add_argument("--repeats", type=int, default=5)
+    startup.add_argument("--warm-up-wait", type=float, default=5.0)
+    startup.add_argument("--synthetic-audio", action="store_true")
+    startup.set_defaults(run=run_startup)
+
+    broker = subparsers.add_parser("broker", help="Two servers and one worker on a shared broker")
+    broker.add_argument("--port", type=int, default=5050)
+    broker.add_argument("--timeout", type=float, default=120.0)
+    broker.add_argument("--synthetic-audio", action="store_true")
+    broker.set_defaults(run=run_broker)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
 """
 Run server with Eventlet for WebSocket support
+
+Runs in async mode; see run_eventlet.py.
 """
+import os
 import eventlet
-eventlet.monkey_patch()
-
-from app import app, socketio
 
 if __name__ == "__main__":
+    os.environ.setdefault("SERVER_MODE", "async")
+    eventlet.monkey_patch()
+
+    from app import app, socketio
+    from utils.offload import exit_on_sigterm
+
+    exit_on_sigterm()
+
     # Run the application with eventlet
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
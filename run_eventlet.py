@@ -1,7 +1,22 @@
-import eventlet
-eventlet.monkey_patch()
+"""
+Run server in async mode on Eventlet
 
-from app import app, socketio
+CPU-bound render stages run in a process pool and ffmpeg runs as green
+child processes, so renders never stall socket heartbeats. Equivalent
+gunicorn deployment: SERVER_MODE=async gunicorn -k eventlet -w 1 main:app
+"""
+import os
+import eventlet
 
+# Everything lives under the main guard: render pool processes are spawned
+# and re-import this module, and must not patch or start a server
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True, use_reloader=False, log_output=True)
\ No newline at end of file
+    os.environ.setdefault("SERVER_MODE", "async")
+    eventlet.monkey_patch()
+
+    from app import app, socketio
+    from utils.offload import exit_on_sigterm
+
+    exit_on_sigterm()
+
+    socketio.run(app, host="0.0.0.0", port=5000, debug=True, use_reloader=False, log_output=True)
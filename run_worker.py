@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+Run a standalone job worker for multi-process deployments
+
+Web processes started with the same JOB_BROKER_URL enqueue jobs and relay
+the progress this worker publishes to their connected clients.
+"""
+import os
+import logging
+from utils.broker import create_broker
+from utils.worker import run_worker
+from utils.warmup import warm_up
+from utils.offload import exit_on_sigterm
+
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == "__main__":
+    broker_url = os.environ.get("JOB_BROKER_URL", "sqlite:///temp/broker.db")
+    if broker_url.startswith("local://"):
+        raise SystemExit("A local:// broker is private to the web process, which runs its own jobs; "
+                         "use a shared broker such as sqlite:///temp/broker.db")
+    broker = create_broker(broker_url, max_jobs_per_client=int(os.environ.get("MAX_JOBS_PER_CLIENT", 2)))
+    exit_on_sigterm()
+    warm_up()
+    print("Starting job worker...")
+    run_worker(broker, concurrency=int(os.environ.get("RENDER_WORKERS", 2)))
@@ -436,7 +436,8 @@ function handleGeneration(e) {
   const data = {
     text: textInput.value,
     avatar_id: avatarData.selectedAvatar.id,
-    voice: avatarData.selectedVoice.id
+    voice: avatarData.selectedVoice.id,
+    client_id: window.SocketHandler?.getClientId()
   };
   
   // Show loading
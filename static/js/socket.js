@@ -6,11 +6,28 @@
 // Socket.io connection reference
 let socket;
 
+// Identifies this browser tab across server processes; the server puts the
+// connection in a room with this name and addresses job progress to it
+const clientId = getClientId();
+
 // Initialize Socket.IO connection
 document.addEventListener('DOMContentLoaded', function() {
   initializeSocket();
 });
 
+/**
+ * Get the client ID for this tab, creating one on first use
+ * @returns {string} The client ID
+ */
+function getClientId() {
+  let id = sessionStorage.getItem('client_id');
+  if (!id) {
+    id = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem('client_id', id);
+  }
+  return id;
+}
+
 /**
  * Initialize the Socket.IO connection
  */
@@ -25,7 +42,8 @@ function initializeSocket() {
       reconnectionAttempts: 10,
       reconnectionDelay: 1000,
       timeout: 20000,  // Longer timeout
-      forceNew: true  // Force a new connection
+      forceNew: true,  // Force a new connection
+      query: { client_id: clientId }
     });
     
     // Set up event listeners for socket events
@@ -79,6 +97,15 @@ function handleProcessingUpdate(data) {
   
   // Update UI based on status
   switch (status) {
+    case 'queued':
+      window.UI?.showLoading(
+        data.expected_wait > 0
+          ? `${message || 'Queued'} (expected start in ~${Math.ceil(data.expected_wait)}s)`
+          : (message || 'Queued...')
+      );
+      window.UI?.updateLoadingProgress(0);
+      break;
+
     case 'started':
       window.UI?.showLoading(message || 'Starting processing...');
       window.UI?.updateLoadingProgress(0);
@@ -94,7 +121,7 @@ function handleProcessingUpdate(data) {
     case 'completed':
       window.UI?.hideLoading();
       if (video_path && window.VideoExport) {
-        window.VideoExport.setVideoPath(video_path);
+        window.VideoExport.setVideoPath(video_path, data);
         window.VideoExport.showVideoResult();
       }
       window.UI?.showNotification('Video generated successfully!', 'success');
@@ -171,5 +198,6 @@ function requestPreview(data) {
 // Export functions for use in other modules
 window.SocketHandler = {
   requestPreview,
-  getSocket: () => socket
+  getSocket: () => socket,
+  getClientId: () => clientId
 };
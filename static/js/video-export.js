@@ -6,6 +6,8 @@
 // Video state management
 let videoState = {
   videoPath: null,
+  posterPath: null,
+  stripPath: null,
   videoReady: false,
   videoFormat: 'mp4',
   videoQuality: 'high'
@@ -62,9 +64,12 @@ function setupExportListeners() {
 /**
  * Set the path to the generated video
  * @param {string} path - The path to the video file
+ * @param {Object} [previews] - Poster and strip image paths from the server
  */
-function setVideoPath(path) {
+function setVideoPath(path, previews = {}) {
   videoState.videoPath = path;
+  videoState.posterPath = (supportsWebp() && previews.poster_webp_path) || previews.poster_path || null;
+  videoState.stripPath = previews.strip_path || null;
   videoState.videoReady = true;
   
   // Enable download button if it exists
@@ -73,6 +78,42 @@ function setVideoPath(path) {
   }
 }
 
+/**
+ * Check once whether the browser can display WebP images
+ * @returns {boolean} True if WebP is supported
+ */
+function supportsWebp() {
+  if (supportsWebp.result === undefined) {
+    const canvas = document.createElement('canvas');
+    canvas.width = canvas.height = 1;
+    supportsWebp.result = canvas.toDataURL('image/webp').startsWith('data:image/webp');
+  }
+  return supportsWebp.result;
+}
+
+/**
+ * Seek the result video to the point of the strip that was clicked
+ * @param {MouseEvent} event - Click on the preview strip
+ */
+function seekFromStrip(event) {
+  const video = document.getElementById('result-video');
+  if (!video) return;
+  
+  const fraction = event.offsetX / event.currentTarget.clientWidth;
+  const seek = () => {
+    video.currentTime = fraction * video.duration;
+  };
+  
+  // The video is not preloaded, so its duration may not be known yet
+  if (video.readyState >= 1) {
+    seek();
+  } else {
+    video.addEventListener('loadedmetadata', seek, { once: true });
+    video.preload = 'metadata';
+    video.load();
+  }
+}
+
 /**
  * Show the video result in the designated container
  */
@@ -86,10 +127,13 @@ function showVideoResult() {
         <span class="badge bg-success">Ready</span>
       </div>
       <div class="card-body p-0">
-        <video id="result-video" controls class="w-100">
+        <video id="result-video" controls preload="none" class="w-100"${videoState.posterPath ? ` poster="${videoState.posterPath}"` : ''}>
           <source src="${videoState.videoPath}" type="video/mp4">
           Your browser does not support the video tag.
         </video>
+        ${videoState.stripPath ? `
+        <img id="result-strip" class="video-strip w-100" src="${videoState.stripPath}" alt="Video preview strip" title="Click to jump to this point">
+        ` : ''}
       </div>
       <div class="card-footer">
         <div class="d-flex justify-content-between align-items-center">
@@ -155,10 +199,10 @@ function showVideoResult() {
               <div>Audio Only</div>
               <small class="text-muted d-block">MP3 Format</small>
             </div>
-            <div class="export-option">
+            <div class="export-option" data-export="thumbnail">
               <i class="fas fa-file-image"></i>
               <div>Thumbnail</div>
-              <small class="text-muted d-block">PNG Format</small>
+              <small class="text-muted d-block">Poster Frame</small>
             </div>
             <div class="export-option">
               <i class="fas fa-film"></i>
@@ -198,9 +242,19 @@ function showVideoResult() {
     });
   });
   
+  // Preview strip
+  const strip = document.getElementById('result-strip');
+  if (strip) {
+    strip.addEventListener('click', seekFromStrip);
+  }
+  
   // Export options
   videoResultContainer.querySelectorAll('.export-option').forEach(option => {
     option.addEventListener('click', function() {
+      if (this.dataset.export === 'thumbnail' && videoState.posterPath) {
+        downloadFile(videoState.posterPath, `avatar-thumbnail-${Date.now()}.${videoState.posterPath.split('.').pop()}`);
+        return;
+      }
       window.UI?.showNotification('This export option will be available soon!', 'info');
     });
   });
@@ -225,16 +279,7 @@ function downloadVideo() {
   }
   
   try {
-    // Create a temporary anchor element
-    const a = document.createElement('a');
-    a.href = videoState.videoPath;
-    a.download = `avatar-video-${Date.now()}.${videoState.videoFormat}`;
-    a.style.display = 'none';
-    
-    // Add to the DOM, trigger click, and remove
-    document.body.appendChild(a);
-    a.click();
-    document.body.removeChild(a);
+    downloadFile(videoState.videoPath, `avatar-video-${Date.now()}.${videoState.videoFormat}`);
     
     window.UI?.showNotification('Video download started!', 'success');
   } catch (error) {
@@ -246,6 +291,23 @@ function downloadVideo() {
   }
 }
 
+/**
+ * Download a file through a temporary anchor element
+ * @param {string} path - The path to the file
+ * @param {string} filename - The name to save it under
+ */
+function downloadFile(path, filename) {
+  const a = document.createElement('a');
+  a.href = path;
+  a.download = filename;
+  a.style.display = 'none';
+  
+  // Add to the DOM, trigger click, and remove
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+
 /**
  * Share the video to social media
  * @param {string} platform - The platform to share to (facebook, twitter, linkedin)
@@ -0,0 +1,234 @@
+import os
+import json
+import uuid
+import logging
+import zipfile
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from utils.segments import split_sentences, get_segment_audio, get_segment_video, concatenate_segments
+from utils.lip_sync import resolve_avatar_frame_path, get_avatar_frame
+from utils.scheduler import estimate_job_cost
+from utils.video_processor import combine_preview_assets, VideoProcessingError
+from utils.offload import run_in_process, is_async_mode
+
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = "static/videos/batches"
+
+# Largest batch accepted by the API
+MAX_BATCH_ITEMS = 500
+
+# Parallelism when no scheduler is supplied, e.g. in a standalone worker
+DEFAULT_BATCH_WORKERS = 2
+
+def validate_batch_items(items):
+    """
+    Normalize batch items and reject malformed ones
+
+    Returns:
+    - List of dicts with text, avatar_id and voice
+
+    Raises:
+    - ValueError describing the first invalid item
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("Items must be a non-empty list")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"A batch can contain at most {MAX_BATCH_ITEMS} items")
+
+    normalized = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {index} must be an object")
+        text = item.get('text', '')
+        avatar_id = item.get('avatar_id', '')
+        voice = item.get('voice', 'en-US-AriaNeural')
+        if not isinstance(text, str) or not isinstance(avatar_id, str):
+            raise ValueError(f"Item {index}: text and avatar ID must be strings")
+        if not isinstance(voice, str) or not voice:
+            raise ValueError(f"Item {index}: voice must be a non-empty string")
+        if not text or not avatar_id or not split_sentences(text):
+            raise ValueError(f"Item {index}: text and avatar ID are required")
+        normalized.append({
+            'text': text,
+            'avatar_id': avatar_id,
+            'voice': voice
+        })
+    return normalized
+
+def run_batch_job(batch_id, items, send, submit=None, make_zip=False):
+    """
+    Render many scripts as one job, sharing work between them
+
+    Identical sentences are synthesized once per voice and rendered once per
+    avatar across the whole batch, and the remaining work is spread over the
+    worker pool. Each segment is rendered as soon as its own speech is ready
+    rather than after the whole batch is synthesized. Avatar frames are cached per render process; in threading
+    mode every avatar is decoded up front, once for the whole batch, while
+    in async mode each pool process decodes an avatar on first use (or at
+    warm-up, see utils/warmup.py). A 'batch_update' event is
+    sent as soon as each item's segments have all settled, and a manifest (optionally a zip) is written
+    when the batch is done.
+
+    Parameters:
+    - batch_id: ID of the batch, used for the output directory
+    - items: Validated items, see validate_batch_items
+    - send: Callable taking (event, data) to report progress
+    - submit: Optional callable taking (fn, cost) and returning a Future; by
+      default work runs on a local thread pool
+    - make_zip: Also bundle the videos and manifest into a zip
+
+    Returns:
+    - The manifest dict
+    """
+    executor = None
+    if submit is None:
+        executor = ThreadPoolExecutor(max_workers=DEFAULT_BATCH_WORKERS)
+        submit = lambda fn, cost: executor.submit(fn)
+
+    try:
+        batch_dir = os.path.join(BATCH_DIR, batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        os.makedirs("static/videos/final", exist_ok=True)
+        os.makedirs("temp", exist_ok=True)
+
+        send('batch_update', {
+            'batch_id': batch_id,
+            'status': 'started',
+            'message': f'Starting batch of {len(items)} videos',
+            'total': len(items)
+        })
+
+        # Decode each avatar once for the whole batch. In async mode the
+        # frames are drawn in the pool processes, which have their own cache,
+        # and decoding here would only block the event loop
+        if not is_async_mode():
+            for avatar_id in {item['avatar_id'] for item in items}:
+                get_avatar_frame(resolve_avatar_frame_path(avatar_id))
+
+        item_segments = [
+            [(sentence, item['avatar_id'], item['voice']) for sentence in split_sentences(item['text'])]
+            for item in items
+        ]
+        results = [{'index': i, **item, 'status': 'pending'} for i, item in enumerate(items)]
+
+        # Each distinct (sentence, voice) is synthesized once, and each
+        # distinct (sentence, avatar, voice) is rendered once, as soon as its
+        # own speech is ready, so items complete while others still synthesize
+        segments_by_speech = {}
+        items_by_segment = {}
+        for i, segments in enumerate(item_segments):
+            for key in segments:
+                segments_by_speech.setdefault((key[0], key[2]), set()).add(key)
+                items_by_segment.setdefault(key, set()).add(i)
+        unsettled = [len(set(segments)) for segments in item_segments]
+
+        segment_paths = {}
+        failed_segments = {}
+        settled = queue.Queue()
+
+        def on_segment_done(key, future):
+            if future.exception():
+                settled.put((key, None, future.exception()))
+            else:
+                settled.put((key, future.result(), None))
+
+        def on_speech_done(speech_key, future):
+            # Runs on whichever thread finished the speech
+            for key in segments_by_speech[speech_key]:
+                if future.exception():
+                    settled.put((key, None, future.exception()))
+                    continue
+                try:
+                    segment_future = submit(lambda key=key: get_segment_video(*key)[0], estimate_job_cost(key[0], key[2]))
+                except Exception as e:
+                    settled.put((key, None, e))
+                    continue
+                segment_future.add_done_callback(lambda f, key=key: on_segment_done(key, f))
+
+        for speech_key in segments_by_speech:
+            speech_future = submit(lambda key=speech_key: get_segment_audio(*key),
+                                   estimate_job_cost(speech_key[0], speech_key[1], profile='preview'))
+            speech_future.add_done_callback(lambda f, key=speech_key: on_speech_done(key, f))
+
+        completed = 0
+        for _ in range(len(items_by_segment)):
+            key, path, error = settled.get()
+            if error is not None:
+                failed_segments[key] = error
+            else:
+                segment_paths[key] = path
+
+            # Stitch every item whose segments are now all settled
+            for i in sorted(items_by_segment[key]):
+                unsettled[i] -= 1
+                if unsettled[i]:
+                    continue
+                _finish_item(results[i], item_segments[i], segment_paths, failed_segments)
+                completed += 1
+                send('batch_update', {
+                    'batch_id': batch_id,
+                    'status': 'item_completed' if results[i]['status'] == 'completed' else 'item_error',
+                    'completed': completed,
+                    'total': len(items),
+                    'item': results[i]
+                })
+
+        # Write the manifest, and the zip if requested
+        manifest = {
+            'batch_id': batch_id,
+            'status': 'completed',
+            'total': len(items),
+            'succeeded': sum(result['status'] == 'completed' for result in results),
+            'items': results,
+            'manifest_path': os.path.join(batch_dir, "manifest.json"),
+            'zip_path': os.path.join(batch_dir, f"batch_{batch_id}.zip") if make_zip else None
+        }
+        with open(manifest['manifest_path'], "w") as f:
+            json.dump(manifest, f, indent=2)
+        if make_zip:
+            _write_zip(manifest)
+
+        send('batch_update', {
+            'batch_id': batch_id,
+            'status': 'completed',
+            'message': f"{manifest['succeeded']} of {len(items)} videos ready",
+            'manifest_path': manifest['manifest_path'],
+            'zip_path': manifest['zip_path']
+        })
+
+        return manifest
+
+    except Exception as e:
+        logger.error(f"Batch {batch_id} failed: {e}")
+        send('batch_update', {'batch_id': batch_id, 'status': 'error', 'message': f'Error: {str(e)}'})
+        raise
+
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+def _finish_item(result, segments, segment_paths, failed_segments):
+    errors = [failed_segments[key] for key in segments if key in failed_segments]
+    if errors:
+        result.update(status='error', error=str(errors[0]))
+        if isinstance(errors[0], VideoProcessingError):
+            result['error_data'] = errors[0].error_data
+        return
+
+    try:
+        output_path = f"static/videos/final/avatar_video_{uuid.uuid4()}.mp4"
+        paths = [segment_paths[key] for key in segments]
+        concatenate_segments(paths, output_path)
+        result.update(status='completed', video_path=output_path, **run_in_process(combine_preview_assets, paths, output_path))
+    except Exception as e:
+        logger.error(f"Failed to stitch batch item {result['index']}: {e}")
+        result.update(status='error', error=str(e))
+
+def _write_zip(manifest):
+    # Videos are already compressed, so store them as-is
+    with zipfile.ZipFile(manifest['zip_path'], "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.write(manifest['manifest_path'], "manifest.json")
+        for result in manifest['items']:
+            if result['status'] == 'completed':
+                archive.write(result['video_path'], f"{result['index']:04d}_{os.path.basename(result['video_path'])}")
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# How often the SQLite broker checks for new rows while waiting
+SQLITE_POLL_INTERVAL = 0.1
+
+# Progress events older than this are pruned
+PROGRESS_RETENTION_SECONDS = 3600
+
+# A claimed job whose worker has not renewed it for this long is assumed
+# lost (e.g. the worker died mid-render) and can be claimed again
+JOB_LEASE_SECONDS = 60
+
+class ProgressBroker:
+    """
+    Carries render jobs from web workers to job workers, and progress events back
+
+    Any web worker may enqueue a job and any job worker may claim it. Job
+    workers publish progress addressed to a SocketIO room; every web worker
+    relays every event to that room, and only the worker actually holding
+    the client's connection delivers it.
+
+    A claim is a lease: the worker renews it while the job runs, and a job
+    whose lease expires is handed to another worker. A client never has
+    more than max_jobs_per_client jobs claimed at once (None for no cap);
+    the cap is enforced by whichever process claims jobs.
+
+    Subclasses implement the storage: LocalBroker for a single process and
+    tests, SQLiteBroker for several processes on one host.
+    """
+
+    def push_job(self, payload, lane, cost, client_id=None):
+        """
+        Enqueue a job payload (a JSON-serializable dict) and return its job ID
+
+        client_id identifies the submitter for the per-client cap.
+        """
+        raise NotImplementedError
+
+    def claim_job(self, timeout=1.0):
+        """
+        Claim the next job, waiting up to timeout seconds
+
+        Previews are claimed before exports; exports are claimed
+        shortest-first, with cost reduced by how long the job has waited.
+        Jobs of clients already at their cap are skipped.
+
+        Returns:
+        - Tuple of (job_id, payload), or None if nothing was queued
+        """
+        raise NotImplementedError
+
+    def renew_job(self, job_id):
+        """
+        Extend the lease on a claimed job; call at least every JOB_LEASE_SECONDS
+        """
+        raise NotImplementedError
+
+    def complete_job(self, job_id):
+        """
+        Remove a finished job from the broker
+        """
+        raise NotImplementedError
+
+    def publish(self, room, event, data):
+        """
+        Publish a progress event for a SocketIO room (None broadcasts)
+        """
+        raise NotImplementedError
+
+    def latest_event_id(self):
+        """
+        Return the ID of the most recent progress event, or 0
+        """
+        raise NotImplementedError
+
+    def poll(self, after_id, timeout=1.0):
+        """
+        Return progress events newer than after_id, waiting up to timeout seconds
+
+        Returns:
+        - List of (event_id, room, event, data) tuples in publish order
+        """
+        raise NotImplementedError
+
+def _job_rank(lane, cost, submitted_at, now, aging_rate):
+    # Lower ranks are claimed first; previews always outrank exports
+    return (lane != "preview", cost - aging_rate * (now - submitted_at))
+
+class LocalBroker(ProgressBroker):
+    """
+    In-process broker, for single-process deployments and tests
+    """
+
+    def __init__(self, aging_rate=0.5, max_jobs_per_client=None):
+        self.aging_rate = aging_rate
+        self.max_jobs_per_client = max_jobs_per_client
+        self._jobs = {}
+        # (event_id, room, event, data, created_at), oldest first
+        self._events = deque()
+        self._next_event_id = 1
+        self._condition = threading.Condition()
+
+    def push_job(self, payload, lane, cost, client_id=None):
+        job_id = str(uuid.uuid4())
+        with self._condition:
+            self._jobs[job_id] = {
+                'payload': payload,
+                'lane': lane,
+                'cost': cost,
+                'client_id': client_id,
+                'submitted_at': time.time(),
+                'claimed_at': None
+            }
+            self._condition.notify_all()
+        return job_id
+
+    def claim_job(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                lease_expiry = now - JOB_LEASE_SECONDS
+                claimed_per_client = {}
+                for job in self._jobs.values():
+                    if job['claimed_at'] is not None and job['claimed_at'] >= lease_expiry:
+                        claimed_per_client[job['client_id']] = claimed_per_client.get(job['client_id'], 0) + 1
+
+                waiting = [
+                    (_job_rank(job['lane'], job['cost'], job['submitted_at'], now, self.aging_rate), job_id)
+                    for job_id, job in self._jobs.items()
+                    if (job['claimed_at'] is None or job['claimed_at'] < lease_expiry)
+                    and not self._at_cap(job['client_id'], claimed_per_client)
+                ]
+                if waiting:
+                    _, job_id = min(waiting)
+                    self._jobs[job_id]['claimed_at'] = now
+                    return job_id, self._jobs[job_id]['payload']
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def _at_cap(self, client_id, claimed_per_client):
+        if client_id is None or self.max_jobs_per_client is None:
+            return False
+        return claimed_per_client.get(client_id, 0) >= self.max_jobs_per_client
+
+    def renew_job(self, job_id):
+        with self._condition:
+            if job_id in self._jobs:
+                self._jobs[job_id]['claimed_at'] = time.time()
+
+    def complete_job(self, job_id):
+        with self._condition:
+            self._jobs.pop(job_id, None)
+            # A client slot was freed, which may unblock a waiting job
+            self._condition.notify_all()
+
+    def publish(self, room, event, data):
+        now = time.time()
+        with self._condition:
+            self._events.append((self._next_event_id, room, event, data, now))
+            self._next_event_id += 1
+            while self._events[0][4] < now - PROGRESS_RETENTION_SECONDS:
+                self._events.popleft()
+            self._condition.notify_all()
+
+    def latest_event_id(self):
+        with self._condition:
+            return self._next_event_id - 1
+
+    def poll(self, after_id, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = [event[:4] for event in self._events if event[0] > after_id]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._condition.wait(remaining)
+
+class SQLiteBroker(ProgressBroker):
+    """
+    Broker backed by a SQLite file shared by every process on the host
+    """
+
+    def __init__(self, path, aging_rate=0.5, max_jobs_per_client=None):
+        self.path = path
+        self.aging_rate = aging_rate
+        self.max_jobs_per_client = max_jobs_per_client
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, lane TEXT, cost REAL, payload TEXT, "
+                "submitted_at REAL, claimed_at REAL, client_id TEXT)"
+            )
+            # Broker files created before the per-client cap lack client_id
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "client_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN client_id TEXT")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, room TEXT, event TEXT, "
+                "data TEXT, created_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS progress_created_at ON progress (created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps the broker safe to share between threads
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def push_job(self, payload, lane, cost, client_id=None):
+        job_id = str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, lane, cost, payload, submitted_at, client_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, lane, cost, json.dumps(payload), time.time(), client_id)
+            )
+        return job_id
+
+    def claim_job(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                # Take the write lock first so two workers cannot claim the same job
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    lease_expiry = now - JOB_LEASE_SECONDS
+                    # A job is claimable when unclaimed or its lease expired,
+                    # and its client has fewer than the cap in live claims
+                    row = conn.execute(
+                        "SELECT id, payload FROM jobs AS waiting "
+                        "WHERE (claimed_at IS NULL OR claimed_at < :expiry) "
+                        "AND (:cap IS NULL OR client_id IS NULL OR ("
+                        "  SELECT COUNT(*) FROM jobs AS running "
+                        "  WHERE running.client_id = waiting.client_id AND running.claimed_at >= :expiry"
+                        ") < :cap) "
+                        "ORDER BY lane != 'preview', cost - :aging_rate * (:now - submitted_at) LIMIT 1",
+                        {'expiry': lease_expiry, 'cap': self.max_jobs_per_client,
+                         'aging_rate': self.aging_rate, 'now': now}
+                    ).fetchone()
+                    if row:
+                        conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ?", (now, row[0]))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+            if row:
+                return row[0], json.loads(row[1])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(SQLITE_POLL_INTERVAL)
+
+    def renew_job(self, job_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def complete_job(self, job_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def publish(self, room, event, data):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO progress (room, event, data, created_at) VALUES (?, ?, ?, ?)",
+                (room, event, json.dumps(data), now)
+            )
+            conn.execute("DELETE FROM progress WHERE created_at < ?", (now - PROGRESS_RETENTION_SECONDS,))
+
+    def latest_event_id(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM progress").fetchone()[0]
+
+    def poll(self, after_id, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, room, event, data FROM progress WHERE id > ? ORDER BY id",
+                    (after_id,)
+                ).fetchall()
+            if rows or time.monotonic() >= deadline:
+                return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+            time.sleep(SQLITE_POLL_INTERVAL)
+
+def create_broker(url, max_jobs_per_client=None):
+    """
+    Create a broker from a URL: 'local://' or 'sqlite:///path/to/broker.db'
+
+    A local broker only reaches workers in the same process, so whoever
+    creates one must also run the worker (see app.py).
+
+    Parameters:
+    - url: Broker URL
+    - max_jobs_per_client: Per-client cap enforced when claiming jobs
+    """
+    if url.startswith("local://"):
+        return LocalBroker(max_jobs_per_client=max_jobs_per_client)
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(url[len("sqlite:///"):], max_jobs_per_client=max_jobs_per_client)
+    raise ValueError(f"Unsupported broker URL: {url}")
+
+def relay_progress(broker, emit, stop_event=None):
+    """
+    Forward progress events from the broker to SocketIO clients, until stopped
+
+    Only events published after the relay starts are forwarded.
+
+    Parameters:
+    - broker: The ProgressBroker to read from
+    - emit: Callable like socketio.emit, called as emit(event, data, to=room)
+    - stop_event: Optional threading.Event that ends the loop when set
+    """
+    last_id = broker.latest_event_id()
+    while stop_event is None or not stop_event.is_set():
+        try:
+            for event_id, room, event, data in broker.poll(last_id):
+                emit(event, data, to=room)
+                last_id = event_id
+        except Exception as e:
+            logger.error(f"Error relaying progress events: {e}")
+            time.sleep(1)
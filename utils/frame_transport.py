@@ -0,0 +1,356 @@
+import logging
+import multiprocessing
+import queue
+import time
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# How long the encoder feeder waits for a frame before checking that the
+# upstream stages are still alive
+STAGE_POLL_TIMEOUT = 1.0
+
+# Longest a whole pipeline run may take before it is abandoned as stuck
+PIPELINE_TIMEOUT = 120.0
+
+# Stages are forked from a single-threaded fork server, never from the
+# caller: forking a multi-threaded server copies locks other threads hold
+# (and their open pipes, e.g. another encoder's stdin) into the children.
+# The server preloads the render modules so each stage starts quickly.
+_context = multiprocessing.get_context("forkserver")
+_context.set_forkserver_preload(["numpy", "cv2", "utils.lip_sync", "utils.video_processor"])
+
+class FrameSlab:
+    """
+    A fixed pool of frame slots backed by a single shared memory block
+
+    Frames never travel through a queue: a stage writes into a slot and
+    hands only the slot index to the next stage, which reads the pixels in
+    place. Every process maps the same block, so a handoff costs a few bytes
+    regardless of the frame size.
+    """
+
+    def __init__(self, slot_count, frame_shape, name=None):
+        """
+        Create a new slab, or attach to an existing one when name is given
+
+        Parameters:
+        - slot_count: Number of frames the slab can hold at once
+        - frame_shape: Shape of a single uint8 frame, e.g. (480, 640, 3)
+        - name: Name of an existing shared memory block to attach to
+        """
+        self.slot_count = slot_count
+        self.frame_shape = tuple(frame_shape)
+        self.frame_nbytes = int(np.prod(self.frame_shape))
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(
+            name=name,
+            create=self._owner,
+            size=slot_count * self.frame_nbytes
+        )
+        self._frames = np.ndarray(
+            (slot_count,) + self.frame_shape,
+            dtype=np.uint8,
+            buffer=self._shm.buf
+        )
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def descriptor(self):
+        """
+        Return a small picklable description used to attach from another process
+        """
+        return (self.name, self.slot_count, self.frame_shape)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Attach to a slab created by another process from its descriptor
+        """
+        name, slot_count, frame_shape = descriptor
+        return cls(slot_count, frame_shape, name=name)
+
+    def slot(self, index):
+        """
+        Return a writable view of the frame stored in the given slot
+        """
+        return self._frames[index]
+
+    def close(self):
+        """
+        Release this process's mapping, and free the block if we created it
+        """
+        # The view must go before the mapping can be closed
+        self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+def _render_stage(descriptor, render_frame, frame_count, free_slots, rendered):
+    """
+    First pipeline stage: render frames into free slots
+    """
+    slab = FrameSlab.attach(descriptor)
+    try:
+        for i in range(frame_count):
+            index = free_slots.get()
+            slab.slot(index)[:] = render_frame(i)
+            rendered.put((index, i))
+    finally:
+        rendered.put(None)
+        slab.close()
+
+def _effects_stage(descriptor, process_frame, frame_count, rendered, ready):
+    """
+    Second pipeline stage: apply per-frame effects to rendered slots in place
+    """
+    slab = FrameSlab.attach(descriptor)
+    try:
+        while True:
+            item = rendered.get()
+            if item is None:
+                break
+            index, i = item
+            frame = slab.slot(index)
+            frame[:] = process_frame(frame, i, frame_count)
+            ready.put(item)
+    finally:
+        ready.put(None)
+        slab.close()
+
+def run_frame_pipeline(render_frame, frame_count, frame_shape, consume_frame,
+                       process_frame=None, slot_count=8, timeout=PIPELINE_TIMEOUT):
+    """
+    Run render -> effects -> encoder feeder across processes over a FrameSlab
+
+    The renderer and the effects stage each run in their own process; the
+    calling process feeds frames to the encoder. Only slot indices are
+    passed between processes. A slot is returned to the renderer as soon as
+    consume_frame returns, so consume_frame must not keep a reference to the
+    frame it is given.
+
+    Parameters:
+    - render_frame: Picklable callable taking a frame index and returning a frame
+    - frame_count: Number of frames to render
+    - frame_shape: Shape of a single uint8 frame
+    - consume_frame: Callable taking (frame, frame_index), e.g. an encoder writer
+    - process_frame: Picklable callable taking (frame, frame_index, total_frames);
+      defaults to apply_expressions_and_gestures
+    - slot_count: Number of frames that may be in flight at once
+    - timeout: Seconds after which a run that has not finished is stopped
+
+    Returns:
+    - Number of frames consumed
+
+    Raises:
+    - RuntimeError if a stage fails or the run exceeds its timeout
+    """
+    if process_frame is None:
+        from utils.video_processor import apply_expressions_and_gestures
+        process_frame = apply_expressions_and_gestures
+
+    deadline = time.monotonic() + timeout
+    slab = FrameSlab(slot_count, frame_shape)
+    free_slots = _context.Queue()
+    rendered = _context.Queue()
+    ready = _context.Queue()
+    for index in range(slot_count):
+        free_slots.put(index)
+
+    descriptor = slab.descriptor()
+    stages = [
+        _context.Process(
+            target=_render_stage,
+            args=(descriptor, render_frame, frame_count, free_slots, rendered),
+            daemon=True
+        ),
+        _context.Process(
+            target=_effects_stage,
+            args=(descriptor, process_frame, frame_count, rendered, ready),
+            daemon=True
+        ),
+    ]
+
+    consumed = 0
+    try:
+        for stage in stages:
+            stage.start()
+
+        while True:
+            try:
+                item = ready.get(timeout=STAGE_POLL_TIMEOUT)
+            except queue.Empty:
+                if not all(stage.is_alive() for stage in stages):
+                    raise RuntimeError("Frame pipeline stage exited unexpectedly")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Frame pipeline did not finish within {timeout:.0f}s")
+                continue
+            if item is None:
+                break
+            index, i = item
+            consume_frame(slab.slot(index), i)
+            free_slots.put(index)
+            consumed += 1
+
+        for stage in stages:
+            stage.join(max(deadline - time.monotonic(), 0))
+            if stage.exitcode != 0:
+                raise RuntimeError(f"Frame pipeline stage failed with exit code {stage.exitcode}")
+
+        return consumed
+
+    except Exception as e:
+        logger.error(f"Error in frame pipeline: {e}")
+        raise
+
+    finally:
+        for stage in stages:
+            # A stage that failed to start has nothing to stop
+            if stage.pid is None:
+                continue
+            if stage.is_alive():
+                stage.terminate()
+            stage.join()
+        slab.close()
+
+def render_lip_sync_frames(avatar_frame, frame_count, consume_frame, slot_count=8):
+    """
+    Render lip sync frames with expressions and gestures applied, out of process
+
+    Parameters:
+    - avatar_frame: The still avatar frame, as returned by load_avatar_frame
+    - frame_count: Number of frames to render
+    - consume_frame: Callable taking (frame, frame_index), e.g. an encoder writer
+    - slot_count: Number of frames that may be in flight at once
+
+    Returns:
+    - Number of frames consumed
+    """
+    from utils.lip_sync import draw_lip_sync_frame
+
+    return run_frame_pipeline(
+        partial(draw_lip_sync_frame, avatar_frame),
+        frame_count,
+        avatar_frame.shape,
+        consume_frame,
+        slot_count=slot_count
+    )
+
+# Microbenchmark: shared memory slab vs pickled queues vs pipes
+
+def _copy_frame(source, frame_index):
+    return source
+
+def _passthrough_frame(frame, frame_index, total_frames):
+    return frame
+
+def _queue_render_stage(source, frame_count, out_queue):
+    for i in range(frame_count):
+        out_queue.put((i, source.copy()))
+    out_queue.put(None)
+
+def _queue_effects_stage(in_queue, out_queue):
+    while True:
+        item = in_queue.get()
+        out_queue.put(item)
+        if item is None:
+            break
+
+def _pipe_render_stage(source, frame_count, conn):
+    for i in range(frame_count):
+        conn.send((i, source.copy()))
+    conn.send(None)
+    conn.close()
+
+def _pipe_effects_stage(in_conn, out_conn):
+    while True:
+        item = in_conn.recv()
+        out_conn.send(item)
+        if item is None:
+            break
+    out_conn.close()
+
+def _benchmark_queues(source, frame_count):
+    rendered = _context.Queue(maxsize=8)
+    ready = _context.Queue(maxsize=8)
+    stages = [
+        _context.Process(target=_queue_render_stage, args=(source, frame_count, rendered)),
+        _context.Process(target=_queue_effects_stage, args=(rendered, ready)),
+    ]
+    for stage in stages:
+        stage.start()
+    while ready.get() is not None:
+        pass
+    for stage in stages:
+        stage.join()
+
+def _benchmark_pipes(source, frame_count):
+    render_recv, render_send = _context.Pipe(duplex=False)
+    ready_recv, ready_send = _context.Pipe(duplex=False)
+    stages = [
+        _context.Process(target=_pipe_render_stage, args=(source, frame_count, render_send)),
+        _context.Process(target=_pipe_effects_stage, args=(render_recv, ready_send)),
+    ]
+    for stage in stages:
+        stage.start()
+    while ready_recv.recv() is not None:
+        pass
+    for stage in stages:
+        stage.join()
+
+def _benchmark_slab(source, frame_count):
+    run_frame_pipeline(
+        partial(_copy_frame, source),
+        frame_count,
+        source.shape,
+        lambda frame, i: None,
+        process_frame=_passthrough_frame
+    )
+
+def benchmark_transport(frame_count=300, frame_shape=(480, 640, 3), repeats=3):
+    """
+    Time moving frames through a three-process pipeline with each transport
+
+    Every transport runs the same renderer -> effects -> feeder topology with
+    no-op stages, so the numbers isolate the cost of the handoff itself.
+
+    Returns:
+    - Dict mapping transport name to the best observed frames per second
+    """
+    source = np.random.randint(0, 256, frame_shape, dtype=np.uint8)
+    transports = {
+        "shared_memory": _benchmark_slab,
+        "pickled_queue": _benchmark_queues,
+        "pipe": _benchmark_pipes,
+    }
+
+    results = {}
+    for name, run in transports.items():
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run(source, frame_count)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = frame_count / best
+
+    return results
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark inter-process frame transports")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    results = benchmark_transport(args.frames, (args.height, args.width, 3), args.repeats)
+    for name, fps in results.items():
+        print(f"{name:>14}: {fps:8.1f} frames/s")
@@ -0,0 +1,94 @@
+import logging
+from utils.tts import generate_speech
+from utils.lip_sync import generate_lip_sync
+from utils.segments import generate_segmented_video
+from utils.video_processor import VideoProcessingError
+from utils.offload import run_in_process
+
+logger = logging.getLogger(__name__)
+
+# Job bodies shared by the web process and standalone workers. Each takes a
+# send(event, data) callable that delivers progress events to the client,
+# either directly through SocketIO or through a progress broker.
+
+def run_export_job(text, avatar_id, voice, send):
+    """
+    Render a full video and report progress through 'processing_update' events
+
+    Returns:
+    - The result of generate_segmented_video
+    """
+    try:
+        # Emit starting event
+        send('processing_update', {'status': 'started', 'message': 'Starting video generation'})
+
+        def report_progress(progress, message):
+            send('processing_update', {'status': 'in_progress', 'message': message, 'progress': progress})
+
+        # Render the script sentence by sentence; unchanged sentences come
+        # straight from the segment cache
+        result = generate_segmented_video(text, avatar_id, voice, progress_callback=report_progress)
+
+        # Complete
+        send('processing_update', {
+            'status': 'completed',
+            'message': 'Video ready',
+            'progress': 100,
+            'video_path': result['video_path'],
+            'poster_path': result['poster_path'],
+            'poster_webp_path': result['poster_webp_path'],
+            'strip_path': result['strip_path']
+        })
+
+        return result
+
+    except Exception as e:
+        logger.error(f"Video generation error: {e}")
+        update = {'status': 'error', 'message': f'Error: {str(e)}'}
+        if isinstance(e, VideoProcessingError):
+            update['error_data'] = e.error_data
+        send('processing_update', update)
+        raise
+
+def run_preview_job(text, avatar_id, voice, send):
+    """
+    Render a short lip sync preview and report progress through 'preview_update' events
+    """
+    try:
+        # Start processing the preview
+        send('preview_update', {
+            'status': 'in_progress',
+            'message': 'Generating speech...'
+        })
+
+        # 1. Generate speech (use shorter version of the text for preview)
+        preview_text = text[:100] + ('...' if len(text) > 100 else '')
+        audio_path = run_in_process(generate_speech, preview_text, voice)
+
+        send('preview_update', {
+            'status': 'in_progress',
+            'message': 'Creating preview animation...',
+            'progress': 50
+        })
+
+        # 2. Generate a simplified lip sync for preview
+        # This could be a shorter or lower-quality version for faster preview
+        lip_sync_path = run_in_process(generate_lip_sync, audio_path, avatar_id)
+
+        # 3. Send the completed preview update
+        send('preview_update', {
+            'status': 'completed',
+            'message': 'Preview ready',
+            'preview_data': {
+                'avatar_id': avatar_id,
+                'text': preview_text,
+                'preview_url': lip_sync_path
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Preview generation error: {e}")
+        send('preview_update', {
+            'status': 'error',
+            'message': f'Error generating preview: {str(e)}'
+        })
@@ -2,13 +2,20 @@ import os
 import subprocess
 import uuid
 import logging
-import numpy as np
-import cv2
 import tempfile
 import shutil
+from functools import lru_cache
+from utils.offload import run_ffmpeg
 
 logger = logging.getLogger(__name__)
 
+# cv2 and numpy are imported inside the functions that use them, so that
+# importing this module at server startup stays cheap (see utils/warmup.py)
+
+# Length of the simulated lip sync animation
+LIP_SYNC_FRAME_COUNT = 90  # 3 seconds at 30fps
+LIP_SYNC_FPS = 30
+
 def generate_lip_sync(audio_path, avatar_id):
     """
     Generate lip-synced video using Wav2Lip
@@ -30,25 +37,7 @@ def generate_lip_sync(audio_path, avatar_id):
         output_path = f"static/videos/lip_sync_{job_id}.mp4"
         
         # Get avatar frame path (this would be the image of the avatar to animate)
-        avatar_frame_path = f"static/avatars/{avatar_id}.jpg"
-        
-        # Verify that the avatar frame exists
-        logger.debug(f"Checking for avatar frame at {avatar_frame_path}")
-        if not os.path.exists(avatar_frame_path):
-            logger.warning(f"Avatar frame not found at {avatar_frame_path}")
-            
-            # Try alternative paths
-            alternative_paths = [
-                f"static/images/avatars/{avatar_id}_preview.svg",
-                f"static/images/avatars/{avatar_id.replace('avatar', '')}_preview.svg" # Try without 'avatar' prefix
-            ]
-            
-            for alt_path in alternative_paths:
-                logger.debug(f"Trying alternative path: {alt_path}")
-                if os.path.exists(alt_path):
-                    logger.info(f"Found avatar at alternative path: {alt_path}")
-                    avatar_frame_path = alt_path
-                    break
+        avatar_frame_path = resolve_avatar_frame_path(avatar_id)
         
         logger.debug(f"Generating lip sync for avatar {avatar_id} with audio {audio_path}")
         
@@ -67,6 +56,32 @@ def generate_lip_sync(audio_path, avatar_id):
         logger.error(f"Error in lip sync generation: {e}")
         raise
 
+def resolve_avatar_frame_path(avatar_id):
+    """
+    Find the image to animate for an avatar, falling back to its SVG preview
+    """
+    avatar_frame_path = f"static/avatars/{avatar_id}.jpg"
+
+    # Verify that the avatar frame exists
+    logger.debug(f"Checking for avatar frame at {avatar_frame_path}")
+    if not os.path.exists(avatar_frame_path):
+        logger.warning(f"Avatar frame not found at {avatar_frame_path}")
+        
+        # Try alternative paths
+        alternative_paths = [
+            f"static/images/avatars/{avatar_id}_preview.svg",
+            f"static/images/avatars/{avatar_id.replace('avatar', '')}_preview.svg" # Try without 'avatar' prefix
+        ]
+        
+        for alt_path in alternative_paths:
+            logger.debug(f"Trying alternative path: {alt_path}")
+            if os.path.exists(alt_path):
+                logger.info(f"Found avatar at alternative path: {alt_path}")
+                avatar_frame_path = alt_path
+                break
+    
+    return avatar_frame_path
+
 def simulate_lip_sync(avatar_frame_path, audio_path, output_path):
     """
     Simulate lip sync generation (placeholder for actual Wav2Lip implementation)
@@ -74,6 +89,7 @@ def simulate_lip_sync(avatar_frame_path, audio_path, output_path):
     In a real implementation, this would use the Wav2Lip model to generate
     a lip-synced video from the avatar frame and audio.
     """
+    import cv2
     try:
         # Create a temporary directory for processing
         temp_dir = tempfile.mkdtemp(dir="temp")
@@ -82,79 +98,16 @@ def simulate_lip_sync(avatar_frame_path, audio_path, output_path):
         # using the Wav2Lip model. Here, we'll create a simple animation as a placeholder.
         
         # 1. Generate a sequence of frames (simulating lip movement)
-        frame_count = 90  # 3 seconds at 30fps
+        frame_count = LIP_SYNC_FRAME_COUNT
         frames_dir = os.path.join(temp_dir, "frames")
         os.makedirs(frames_dir, exist_ok=True)
         
-        # Load the avatar frame (or generate a placeholder)
-        avatar_frame = None
-        
-        if os.path.exists(avatar_frame_path):
-            # Check if file is an SVG
-            if avatar_frame_path.lower().endswith('.svg'):
-                logger.debug(f"Avatar is SVG format, creating a colored placeholder")
-                # Create a placeholder with the avatar ID as text for SVG files
-                avatar_frame = np.ones((480, 640, 3), dtype=np.uint8) * 240  # Light gray background
-                
-                # Add a colored circle for the face
-                cv2.circle(
-                    avatar_frame,
-                    (320, 200),  # Center of the frame
-                    120,         # Radius
-                    (120, 180, 240),  # Light blue color
-                    -1           # Filled circle
-                )
-                
-                # Add a name from the avatar ID
-                avatar_name = os.path.basename(avatar_frame_path).split('_')[0].capitalize()
-                cv2.putText(
-                    avatar_frame,
-                    f"{avatar_name}",
-                    (250, 330),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1.5,
-                    (60, 60, 60),
-                    2
-                )
-            else:
-                # Try to read the image
-                avatar_frame = cv2.imread(avatar_frame_path)
-        
-        # If we couldn't load the image, create a placeholder
-        if avatar_frame is None:
-            # Create a placeholder frame if the avatar image doesn't exist or couldn't be loaded
-            avatar_frame = np.ones((480, 640, 3), dtype=np.uint8) * 255
-            # Add text to the placeholder
-            cv2.putText(
-                avatar_frame, 
-                f"Avatar {os.path.basename(avatar_frame_path)}", 
-                (50, 240), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                1, 
-                (0, 0, 0), 
-                2
-            )
+        # Load the avatar frame (or generate a placeholder), decoded once per process
+        avatar_frame = get_avatar_frame(avatar_frame_path)
         
         # Generate frames with simulated lip movement
         for i in range(frame_count):
-            # Make a copy of the frame
-            frame = avatar_frame.copy()
-            
-            # Determine lip opening based on sine wave (simulates speaking)
-            lip_opening = int(10 * np.sin(i * 0.2) + 10)
-            
-            # Draw a simple representation of lips
-            center_x, center_y = frame.shape[1] // 2, frame.shape[0] // 2 + 50
-            cv2.ellipse(
-                frame, 
-                (center_x, center_y), 
-                (30, lip_opening), 
-                0, 
-                0, 
-                360, 
-                (150, 100, 100), 
-                -1
-            )
+            frame = draw_lip_sync_frame(avatar_frame, i)
             
             # Save the frame
             frame_path = os.path.join(frames_dir, f"frame_{i:04d}.jpg")
@@ -177,7 +130,7 @@ def simulate_lip_sync(avatar_frame_path, audio_path, output_path):
         
         try:
             # Try to run ffmpeg
-            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+            run_ffmpeg(ffmpeg_cmd)
             logger.debug("FFMPEG process completed successfully")
         except subprocess.CalledProcessError as e:
             logger.error(f"FFMPEG error: {e.stderr.decode()}")
@@ -191,3 +144,114 @@ def simulate_lip_sync(avatar_frame_path, audio_path, output_path):
     except Exception as e:
         logger.error(f"Error in simulate_lip_sync: {e}")
         raise
+
+def load_avatar_frame(avatar_frame_path):
+    """
+    Load the still avatar frame that the lip sync animation is drawn on
+    
+    SVG avatars and missing or unreadable images are replaced by a drawn
+    640x480 placeholder so that rendering can always proceed.
+    
+    Parameters:
+    - avatar_frame_path: Path to the avatar image
+    
+    Returns:
+    - The avatar frame as a BGR image
+    """
+    import cv2
+    import numpy as np
+    avatar_frame = None
+    
+    if os.path.exists(avatar_frame_path):
+        # Check if file is an SVG
+        if avatar_frame_path.lower().endswith('.svg'):
+            logger.debug(f"Avatar is SVG format, creating a colored placeholder")
+            # Create a placeholder with the avatar ID as text for SVG files
+            avatar_frame = np.ones((480, 640, 3), dtype=np.uint8) * 240  # Light gray background
+            
+            # Add a colored circle for the face
+            cv2.circle(
+                avatar_frame,
+                (320, 200),  # Center of the frame
+                120,         # Radius
+                (120, 180, 240),  # Light blue color
+                -1           # Filled circle
+            )
+            
+            # Add a name from the avatar ID
+            avatar_name = os.path.basename(avatar_frame_path).split('_')[0].capitalize()
+            cv2.putText(
+                avatar_frame,
+                f"{avatar_name}",
+                (250, 330),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                1.5,
+                (60, 60, 60),
+                2
+            )
+        else:
+            # Try to read the image
+            avatar_frame = cv2.imread(avatar_frame_path)
+    
+    # If we couldn't load the image, create a placeholder
+    if avatar_frame is None:
+        # Create a placeholder frame if the avatar image doesn't exist or couldn't be loaded
+        avatar_frame = np.ones((480, 640, 3), dtype=np.uint8) * 255
+        # Add text to the placeholder
+        cv2.putText(
+            avatar_frame, 
+            f"Avatar {os.path.basename(avatar_frame_path)}", 
+            (50, 240), 
+            cv2.FONT_HERSHEY_SIMPLEX, 
+            1, 
+            (0, 0, 0), 
+            2
+        )
+    
+    return avatar_frame
+
+@lru_cache(maxsize=32)
+def get_avatar_frame(avatar_frame_path):
+    """
+    Return the decoded avatar frame, loading it on first use
+    
+    The cached frame is shared between jobs and marked read-only; drawing
+    always works on a copy.
+    """
+    avatar_frame = load_avatar_frame(avatar_frame_path)
+    avatar_frame.flags.writeable = False
+    return avatar_frame
+
+def draw_lip_sync_frame(avatar_frame, frame_index):
+    """
+    Draw a single frame of simulated lip movement on top of the avatar frame
+    
+    Parameters:
+    - avatar_frame: The still avatar frame
+    - frame_index: The index of the frame being drawn
+    
+    Returns:
+    - A new frame with the lips drawn for this frame index
+    """
+    import cv2
+    import numpy as np
+    # Make a copy of the frame
+    frame = avatar_frame.copy()
+    
+    # Determine lip opening based on sine wave (simulates speaking)
+    lip_opening = int(10 * np.sin(frame_index * 0.2) + 10)
+    
+    # Draw a simple representation of lips
+    center_x, center_y = frame.shape[1] // 2, frame.shape[0] // 2 + 50
+    cv2.ellipse(
+        frame, 
+        (center_x, center_y), 
+        (30, lip_opening), 
+        0, 
+        0, 
+        360, 
+        (150, 100, 100), 
+        -1
+    )
+    
+    return frame
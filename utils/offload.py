@@ -0,0 +1,163 @@
+import os
+import atexit
+import signal
+import time
+import logging
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# SERVER_MODE=async runs the server on eventlet. One green thread blocking on
+# CPU work or a child process would stall every socket's heartbeats, so in
+# that mode CPU-bound stages go to a process pool and ffmpeg runs as a green
+# (non-blocking) child process.
+ASYNC_MODE = os.environ.get("SERVER_MODE") == "async"
+
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", os.cpu_count() or 2))
+
+# How often a waiting green thread checks whether its pool job finished
+POOL_POLL_INTERVAL = 0.02
+
+# How often a pool process checks that the server that started it is alive
+PARENT_CHECK_INTERVAL = 1.0
+
+_pool = None
+_submit_lock = threading.Lock()
+_in_pool_process = False
+
+def is_async_mode():
+    """
+    Return True when CPU-bound work must be kept off the event loop
+    """
+    return ASYNC_MODE and not _in_pool_process
+
+def _init_pool_process(parent_pid):
+    global _in_pool_process
+    _in_pool_process = True
+    signal.signal(signal.SIGTERM, lambda signum, frame: _exit_pool_process(128 + signum))
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+
+def _exit_with_parent(parent_pid):
+    # A pool process never sees its server die (it holds both ends of its
+    # own queues), so a server killed outright would leave it running
+    while os.getppid() == parent_pid:
+        time.sleep(PARENT_CHECK_INTERVAL)
+    _exit_pool_process(1)
+
+def _exit_pool_process(status):
+    # Take down the frame pipeline stages of an unfinished render too
+    for child in multiprocessing.active_children():
+        child.terminate()
+    os._exit(status)
+
+def get_process_pool():
+    """
+    Return the shared render process pool, starting it on first use
+    """
+    global _pool
+    if _pool is None:
+        # Spawn rather than fork: forking a monkey-patched, multi-threaded
+        # server is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_process,
+            initargs=(os.getpid(),)
+        )
+        atexit.register(shutdown_process_pool)
+        logger.info(f"Started render process pool with {RENDER_PROCESSES} processes")
+    return _pool
+
+def shutdown_process_pool():
+    """
+    Stop the render process pool, if it was started
+
+    The pool processes are terminated along with any frame pipeline stages
+    they started, so renders still in progress are lost. Registered with
+    atexit when the pool starts, and safe to call from a signal handler.
+    """
+    global _pool
+    # No locks or waits: this may run from a signal handler, on top of a
+    # submit or inside the event loop's hub
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+
+def exit_on_sigterm():
+    """
+    Stop the render process pool and exit at once on SIGTERM
+
+    Python's default SIGTERM handling skips atexit hooks and leaves the
+    spawned pool processes running, and under eventlet a SystemExit raised
+    from a signal handler can be swallowed by the hub, so the handler stops
+    the pool itself and exits directly. Call from the main thread of a
+    runner script.
+    """
+    def handle_sigterm(signum, frame):
+        shutdown_process_pool()
+        logging.shutdown()
+        os._exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+def start_process_pool(warm_up_task):
+    """
+    Spawn the render pool processes now rather than on the first render
+
+    Parameters:
+    - warm_up_task: Picklable callable submitted once per pool slot, e.g. to
+      import the render modules
+    """
+    with _submit_lock:
+        pool = get_process_pool()
+        # Concurrent tasks force the pool up to its full size
+        futures = [pool.submit(warm_up_task) for _ in range(RENDER_PROCESSES)]
+    for future in futures:
+        future.result()
+
+def run_in_process(fn, *args, **kwargs):
+    """
+    Run a CPU-bound stage without blocking the event loop
+
+    In async mode the call runs in the render process pool and the calling
+    green thread yields until it finishes. Otherwise, and inside the pool
+    itself, the call runs inline.
+
+    Parameters:
+    - fn: Picklable, module-level callable
+    - args, kwargs: Picklable arguments for fn
+
+    Returns:
+    - The return value of fn
+    """
+    if not is_async_mode():
+        return fn(*args, **kwargs)
+
+    import eventlet
+
+    # The executor's wakeup pipe must only be written by one green thread
+    # at a time
+    with _submit_lock:
+        future = get_process_pool().submit(fn, *args, **kwargs)
+    # Yield to the hub while waiting so other sockets keep being served
+    while not future.done():
+        eventlet.sleep(POOL_POLL_INTERVAL)
+    return future.result()
+
+def run_ffmpeg(cmd):
+    """
+    Run an ffmpeg command to completion, raising CalledProcessError on failure
+
+    In async mode the child process is waited on cooperatively, so other
+    green threads keep running while it encodes.
+    """
+    if is_async_mode():
+        from eventlet.green import subprocess as green_subprocess
+        return green_subprocess.run(cmd, check=True, capture_output=True)
+    return subprocess.run(cmd, check=True, capture_output=True)
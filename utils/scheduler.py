@@ -0,0 +1,288 @@
+import time
+import uuid
+import heapq
+import logging
+import threading
+from concurrent.futures import Future
+from utils.segments import split_sentences
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LANE = "preview"
+EXPORT_LANE = "export"
+
+# Rough cost model, in seconds of worker time
+SPEECH_CHARS_PER_SECOND = 15
+
+# Speaking rate by voice language, where it differs much from the default;
+# scripts like Chinese and Japanese pack more speech into each character
+VOICE_LANGUAGE_CHARS_PER_SECOND = {
+    "zh": 5,
+    "ja": 8,
+    "ko": 7,
+    "th": 10,
+}
+SEGMENT_OVERHEAD_SECONDS = 1.0
+JOB_OVERHEAD_SECONDS = 0.5
+
+# Relative render cost per encoder profile
+ENCODER_PROFILE_COSTS = {
+    "preview": 0.5,   # lip sync only, single encode
+    "export": 1.0,    # lip sync, effects and both encodes
+}
+
+# A waiting job is sent a fresh 'queued' event when its position changes or
+# its expected start moves by more than this many seconds
+QUEUE_UPDATE_THRESHOLD = 1.0
+
+def estimate_job_cost(text, voice="en-US-AriaNeural", profile="export"):
+    """
+    Estimate how many seconds of worker time a job will take
+
+    Parameters:
+    - text: The text to be spoken
+    - voice: Edge TTS voice, whose language sets the speaking rate
+    - profile: Encoder profile, a key of ENCODER_PROFILE_COSTS
+
+    Returns:
+    - Estimated cost in seconds
+    """
+    language = voice.split("-", 1)[0].lower()
+    chars_per_second = VOICE_LANGUAGE_CHARS_PER_SECOND.get(language, SPEECH_CHARS_PER_SECOND)
+    speech_seconds = len(text) / chars_per_second
+    segment_seconds = len(split_sentences(text)) * SEGMENT_OVERHEAD_SECONDS
+    render_cost = ENCODER_PROFILE_COSTS.get(profile, 1.0)
+    return JOB_OVERHEAD_SECONDS + (speech_seconds + segment_seconds) * render_cost
+
+class _Job:
+    def __init__(self, fn, lane, client_id, cost, on_event):
+        self.id = str(uuid.uuid4())
+        self.fn = fn
+        self.lane = lane
+        self.client_id = client_id
+        self.cost = cost
+        self.on_event = on_event
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.worker_lanes = None
+        self.last_report = None
+        self.future = Future()
+
+class JobScheduler:
+    """
+    Cost-aware job scheduler with a preview lane and an export lane
+
+    Preview jobs have strict priority: some workers are reserved for them,
+    and the shared workers also take a waiting preview before any export.
+    Exports run shortest-job-first, with their estimated cost reduced the
+    longer they wait so long exports cannot starve. A client never has more
+    than max_jobs_per_client jobs running; its extra jobs wait in the queue.
+
+    Waiting jobs get a 'queued' event with their position and expected start
+    when submitted, and again whenever a submitted or started job moves them.
+    """
+
+    def __init__(self, workers=2, preview_workers=1, max_jobs_per_client=2, aging_rate=0.5):
+        """
+        Parameters:
+        - workers: Number of shared workers serving both lanes
+        - preview_workers: Number of workers reserved for the preview lane
+        - max_jobs_per_client: Maximum running jobs per client
+        - aging_rate: Seconds of estimated cost forgiven per second of waiting
+        """
+        self.max_jobs_per_client = max_jobs_per_client
+        self.aging_rate = aging_rate
+        self._queues = {PREVIEW_LANE: [], EXPORT_LANE: []}
+        self._running = {}
+        self._running_per_client = {}
+        self._condition = threading.Condition()
+        # Number of workers serving each combination of lanes
+        self._worker_pools = {
+            (PREVIEW_LANE,): preview_workers,
+            (PREVIEW_LANE, EXPORT_LANE): workers,
+        }
+
+        for i in range(preview_workers):
+            self._start_worker(f"preview-worker-{i}", (PREVIEW_LANE,))
+        for i in range(workers):
+            self._start_worker(f"worker-{i}", (PREVIEW_LANE, EXPORT_LANE))
+
+    def _start_worker(self, name, lanes):
+        thread = threading.Thread(target=self._worker_loop, args=(lanes,), name=name, daemon=True)
+        thread.start()
+
+    def submit(self, fn, lane=EXPORT_LANE, client_id=None, cost=1.0, on_event=None):
+        """
+        Queue a job and report its expected start time
+
+        Parameters:
+        - fn: Callable run on a worker thread; its return value resolves the future
+        - lane: PREVIEW_LANE or EXPORT_LANE
+        - client_id: Identifier used for the per-client concurrency cap
+        - cost: Estimated cost in seconds, see estimate_job_cost
+        - on_event: Optional callable receiving scheduling events as dicts
+
+        Returns:
+        - A concurrent.futures.Future for the job's result
+        """
+        if lane not in self._queues:
+            raise ValueError(f"Unknown lane: {lane}")
+
+        job = _Job(fn, lane, client_id, cost, on_event)
+        with self._condition:
+            self._queues[lane].append(job)
+            # A new job can move every waiting job behind it
+            updates = self._queue_updates()
+            self._condition.notify_all()
+
+        self._send_updates(updates)
+        return job.future
+
+    def _queue_updates(self):
+        """
+        Find waiting jobs whose position or expected start changed
+
+        Called with the lock held; only jobs with an on_event callback are
+        tracked, and the events themselves are built by _send_updates.
+
+        Returns:
+        - List of (job, position, expected_wait) tuples
+        """
+        now = time.time()
+        updates = []
+        for job, position, expected_wait in self._estimate_starts():
+            if job.on_event is None:
+                continue
+            expected_start = now + expected_wait
+            if job.last_report is not None:
+                last_position, last_start = job.last_report
+                if position == last_position and abs(expected_start - last_start) <= QUEUE_UPDATE_THRESHOLD:
+                    continue
+            job.last_report = (position, expected_start)
+            updates.append((job, position, expected_wait))
+        return updates
+
+    def _send_updates(self, updates):
+        # Called without the lock held, as reporting may block on I/O
+        now = time.time()
+        for job, position, expected_wait in updates:
+            self._report(job, {
+                'status': 'queued',
+                'message': 'Waiting for a free worker',
+                'job_id': job.id,
+                'lane': job.lane,
+                'position': position,
+                'estimated_cost': round(job.cost, 1),
+                'expected_wait': round(expected_wait, 1),
+                'expected_start': now + expected_wait
+            })
+
+    def _priority(self, job, now):
+        if job.lane == PREVIEW_LANE:
+            return job.submitted_at
+        return job.cost - self.aging_rate * (now - job.submitted_at)
+
+    def _ordered(self, lane):
+        now = time.monotonic()
+        return sorted(self._queues[lane], key=lambda job: self._priority(job, now))
+
+    def _estimate_starts(self):
+        """
+        Estimate when every waiting job starts, in one pass over the queues
+
+        Replays dispatch in priority order (previews first): each job goes to
+        the earliest free worker that serves its lane, but not before its
+        client is below max_jobs_per_client. Workers and clients become free
+        as the remaining cost of their running jobs is spent.
+
+        Returns:
+        - List of (job, position in its lane, expected wait in seconds)
+        """
+        now = time.monotonic()
+        remaining = {job.id: max(job.cost - (now - job.started_at), 0) for job in self._running.values()}
+
+        # When each worker becomes free, per group of workers
+        free_at = {}
+        for lanes, count in self._worker_pools.items():
+            busy = [remaining[job.id] for job in self._running.values() if job.worker_lanes == lanes]
+            free_at[lanes] = busy + [0.0] * (count - len(busy))
+            heapq.heapify(free_at[lanes])
+
+        # When each client's running jobs finish
+        client_finishes = {}
+        for job in self._running.values():
+            heapq.heappush(client_finishes.setdefault(job.client_id, []), remaining[job.id])
+
+        estimates = []
+        for lane in (PREVIEW_LANE, EXPORT_LANE):
+            pools = [lanes for lanes in free_at if lane in lanes and free_at[lanes]]
+            for position, job in enumerate(self._ordered(lane), start=1):
+                if not pools:
+                    estimates.append((job, position, 0.0))
+                    continue
+                pool = min(pools, key=lambda lanes: free_at[lanes][0])
+                start = free_at[pool][0]
+
+                finishes = client_finishes.setdefault(job.client_id, [])
+                while True:
+                    while finishes and finishes[0] <= start:
+                        heapq.heappop(finishes)
+                    if len(finishes) < self.max_jobs_per_client:
+                        break
+                    start = finishes[0]
+
+                heapq.heapreplace(free_at[pool], start + job.cost)
+                heapq.heappush(finishes, start + job.cost)
+                estimates.append((job, position, start))
+        return estimates
+
+    def _next_job(self, lanes):
+        """
+        Pick the next runnable job for a worker serving the given lanes
+        """
+        for lane in lanes:
+            for job in self._ordered(lane):
+                if self._running_per_client.get(job.client_id, 0) < self.max_jobs_per_client:
+                    self._queues[lane].remove(job)
+                    return job
+        return None
+
+    def _worker_loop(self, lanes):
+        while True:
+            with self._condition:
+                job = self._next_job(lanes)
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job(lanes)
+
+                job.started_at = time.monotonic()
+                job.worker_lanes = lanes
+                self._running[job.id] = job
+                self._running_per_client[job.client_id] = self._running_per_client.get(job.client_id, 0) + 1
+                # Starting a job may move the expected start of the rest
+                updates = self._queue_updates()
+
+            self._send_updates(updates)
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn())
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {e}")
+                    job.future.set_exception(e)
+
+            with self._condition:
+                del self._running[job.id]
+                self._running_per_client[job.client_id] -= 1
+                if not self._running_per_client[job.client_id]:
+                    del self._running_per_client[job.client_id]
+                # A client slot was freed, which may unblock a waiting job
+                self._condition.notify_all()
+
+    def _report(self, job, event):
+        if job.on_event is None:
+            return
+        try:
+            job.on_event(event)
+        except Exception as e:
+            logger.warning(f"Failed to report event for job {job.id}: {e}")
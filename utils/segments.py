@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import subprocess
+import tempfile
+import shutil
+from concurrent.futures import Future
+from utils.tts import generate_speech
+from utils.video_processor import render_avatar_video, preview_asset_paths, combine_preview_assets
+from utils.offload import run_in_process, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_AUDIO_DIR = "static/audio/segments"
+SEGMENT_VIDEO_DIR = "static/videos/segments"
+
+# Bump when speech synthesis changes so stale audio is not reused
+SEGMENT_AUDIO_CACHE_VERSION = 1
+
+# Bump when the render pipeline changes so stale segments are not reused;
+# cached audio stays valid
+SEGMENT_VIDEO_CACHE_VERSION = 3
+
+# Cached segments unused for this long are evicted by prune_segment_cache,
+# and beyond this total size the least recently used ones are too (0
+# disables either limit). Segments used within SEGMENT_CACHE_MIN_AGE are
+# always kept, since a running job may still be about to stitch them.
+SEGMENT_CACHE_MAX_AGE = int(os.environ.get("SEGMENT_CACHE_MAX_AGE", 7 * 24 * 3600))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+SEGMENT_CACHE_MIN_AGE = 3600
+
+# How often a process that renders segments prunes the cache
+SEGMENT_CACHE_PRUNE_INTERVAL = 600
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+# A segment's files share the name up to the key: the video or speech
+# itself plus, for videos, the preview images from preview_asset_paths
+_CACHE_ENTRY = re.compile(r'^((?:segment|speech)_[0-9a-f]+)[._]')
+
+# Cache files being produced in this process, by path
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_last_prune = None
+
+def split_sentences(text):
+    """
+    Split a script into sentences, which are the unit of caching and re-rendering
+    """
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+def segment_key(version, *parts):
+    """
+    Build a stable cache key from a cache version and the content that determines a segment's output
+    """
+    payload = json.dumps([version, *parts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def segment_audio_path(sentence, voice):
+    """
+    Return where the cached speech for a sentence is stored
+    """
+    return os.path.join(SEGMENT_AUDIO_DIR, f"speech_{segment_key(SEGMENT_AUDIO_CACHE_VERSION, sentence, voice)}.mp3")
+
+def get_segment_audio(sentence, voice):
+    """
+    Return the cached speech for a sentence, synthesizing it on a cache miss
+
+    Synthesis runs in the render process pool in async mode.
+    """
+    audio_path = segment_audio_path(sentence, voice)
+    if _cache_hit(audio_path):
+        return audio_path
+
+    os.makedirs(SEGMENT_AUDIO_DIR, exist_ok=True)
+    _produce_once(audio_path, run_in_process, synthesize_segment_audio, sentence, voice, audio_path)
+    return audio_path
+
+def synthesize_segment_audio(sentence, voice, audio_path):
+    """
+    Synthesize the speech for a sentence into audio_path
+    """
+    os.replace(generate_speech(sentence, voice), audio_path)
+
+def get_segment_video(sentence, avatar_id, voice):
+    """
+    Return the cached, fully processed video for a sentence
+
+    Concurrent requests for the same uncached segment render it once; the
+    others wait for that render and share its result.
+
+    Parameters:
+    - sentence: The sentence spoken in this segment
+    - avatar_id: ID of the selected avatar
+    - voice: Edge TTS voice used for the sentence
+
+    Returns:
+    - Tuple of (segment video path, whether it was rendered by this call)
+    """
+    video_path = os.path.join(SEGMENT_VIDEO_DIR, f"segment_{segment_key(SEGMENT_VIDEO_CACHE_VERSION, sentence, avatar_id, voice)}.mp4")
+    if _cache_hit(video_path):
+        return video_path, False
+
+    os.makedirs(SEGMENT_VIDEO_DIR, exist_ok=True)
+    rendered = _produce_once(video_path, _render_segment_here, sentence, avatar_id, voice, video_path)
+    if rendered:
+        _maybe_prune_segment_cache()
+    return video_path, rendered
+
+def _render_segment_here(sentence, avatar_id, voice, video_path):
+    # Synthesize in this process first, so that concurrent renders of one
+    # sentence for different avatars share the speech even in async mode
+    get_segment_audio(sentence, voice)
+    run_in_process(render_segment, sentence, avatar_id, voice, video_path)
+
+def render_segment(sentence, avatar_id, voice, video_path):
+    """
+    Synthesize, lip sync and process one sentence into video_path
+
+    This is the CPU-heavy part of a segment and runs in the render process
+    pool in async mode.
+
+    Raises:
+    - VideoProcessingError if the sentence could not be rendered
+    """
+    audio_path = get_segment_audio(sentence, voice)
+    rendered_path = render_avatar_video(audio_path, avatar_id)
+
+    # Keep the segment's preview images next to it for combine_preview_assets
+    segment_previews = preview_asset_paths(video_path)
+    for key, path in preview_asset_paths(rendered_path).items():
+        if os.path.exists(path):
+            os.replace(path, segment_previews[key])
+
+    os.replace(rendered_path, video_path)
+
+def _cache_hit(path):
+    """
+    Return True if a cache file exists, marking it as recently used
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def _produce_once(path, fn, *args):
+    """
+    Produce a cache file with fn(*args), once for concurrent callers in this process
+
+    Callers that arrive while another is producing the same path wait for
+    it and share its outcome, including its error. Separate processes (job
+    workers, or web workers without a broker) may still both produce it;
+    the result is the same and written with os.replace, so that is only
+    wasted work.
+
+    Returns:
+    - True if this call produced the file, False if another one did
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(path)
+        producing = future is None
+        if producing:
+            future = _in_flight[path] = Future()
+
+    if not producing:
+        future.result()
+        return False
+
+    try:
+        # Another caller may have finished it just before this one registered
+        produced = not os.path.exists(path)
+        if produced:
+            fn(*args)
+        future.set_result(None)
+        return produced
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[path]
+
+def prune_segment_cache(max_age=SEGMENT_CACHE_MAX_AGE, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+    """
+    Evict cached speech and segment videos that have not been used recently
+
+    A segment video is evicted together with its preview images. Entries
+    unused for longer than max_age go first, then the least recently used
+    until the cache fits in max_bytes. Entries used within
+    SEGMENT_CACHE_MIN_AGE are always kept. Rendering processes call this
+    every SEGMENT_CACHE_PRUNE_INTERVAL; it can also be run from cron with
+    python -c "from utils.segments import prune_segment_cache; prune_segment_cache()"
+
+    Parameters:
+    - max_age: Seconds since last use after which an entry is evicted (0: no limit)
+    - max_bytes: Total size the cache is pruned down to (0: no limit)
+
+    Returns:
+    - Tuple of (entries evicted, bytes freed)
+    """
+    entries = {}
+    for directory in (SEGMENT_AUDIO_DIR, SEGMENT_VIDEO_DIR):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            match = _CACHE_ENTRY.match(name)
+            if not match:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entry = entries.setdefault(os.path.join(directory, match.group(1)), {'paths': [], 'size': 0, 'used_at': 0})
+            entry['paths'].append(path)
+            entry['size'] += stat.st_size
+            entry['used_at'] = max(entry['used_at'], stat.st_mtime)
+
+    now = time.time()
+    total = sum(entry['size'] for entry in entries.values())
+    evicted = 0
+    freed = 0
+    for entry in sorted(entries.values(), key=lambda entry: entry['used_at']):
+        idle = now - entry['used_at']
+        expired = max_age and idle > max_age
+        oversized = max_bytes and total > max_bytes
+        # Oldest first, so once an entry is kept every later one is too
+        if idle < SEGMENT_CACHE_MIN_AGE or not (expired or oversized):
+            break
+        for path in entry['paths']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= entry['size']
+        freed += entry['size']
+        evicted += 1
+
+    if evicted:
+        logger.info(f"Evicted {evicted} cached segments ({freed / 1024 ** 2:.1f} MB)")
+    return evicted, freed
+
+def _maybe_prune_segment_cache():
+    global _last_prune
+    with _in_flight_lock:
+        if _last_prune is not None and time.monotonic() - _last_prune < SEGMENT_CACHE_PRUNE_INTERVAL:
+            return
+        _last_prune = time.monotonic()
+
+    try:
+        run_in_process(prune_segment_cache)
+    except Exception as e:
+        logger.warning(f"Failed to prune segment cache: {e}")
+
+def concatenate_segments(segment_paths, output_path):
+    """
+    Join segment videos with stream copy, without re-encoding
+
+    All segments come out of the same encoder settings, so the concat
+    demuxer can splice them directly.
+    """
+    if len(segment_paths) == 1:
+        shutil.copyfile(segment_paths[0], output_path)
+        return output_path
+
+    temp_dir = tempfile.mkdtemp(dir="temp")
+    try:
+        list_path = os.path.join(temp_dir, "segments.txt")
+        with open(list_path, "w") as f:
+            for path in segment_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+
+        concat_cmd = [
+            "ffmpeg",
+            "-y",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", list_path,
+            "-c", "copy",
+            output_path
+        ]
+
+        try:
+            run_ffmpeg(concat_cmd)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to concatenate segments: {e.stderr.decode()}")
+            raise
+
+        return output_path
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def generate_segmented_video(text, avatar_id, voice="en-US-AriaNeural", progress_callback=None):
+    """
+    Generate a video sentence by sentence, re-rendering only uncached sentences
+
+    Editing one sentence of a script and regenerating only synthesizes and
+    renders that sentence; the rest are reused from the segment cache and
+    everything is stitched with stream copy.
+
+    Parameters:
+    - text: The full script
+    - avatar_id: ID of the selected avatar
+    - voice: Edge TTS voice
+    - progress_callback: Optional callable taking (progress, message)
+
+    Returns:
+    - Dict with the final video path, its preview image paths (see
+      preview_asset_paths) and segment counts
+    """
+    os.makedirs("static/videos/final", exist_ok=True)
+    os.makedirs("temp", exist_ok=True)
+
+    sentences = split_sentences(text)
+    if not sentences:
+        raise ValueError("Text contains no sentences")
+
+    segment_paths = []
+    rendered = 0
+    for i, sentence in enumerate(sentences):
+        if progress_callback:
+            progress_callback(int(90 * i / len(sentences)), f"Rendering sentence {i + 1} of {len(sentences)}")
+
+        path, was_rendered = get_segment_video(sentence, avatar_id, voice)
+        segment_paths.append(path)
+        rendered += was_rendered
+
+    logger.debug(f"Rendered {rendered} of {len(sentences)} segments for avatar {avatar_id}")
+
+    if progress_callback:
+        progress_callback(90, "Stitching segments")
+
+    output_path = f"static/videos/final/avatar_video_{uuid.uuid4()}.mp4"
+    concatenate_segments(segment_paths, output_path)
+    previews = run_in_process(combine_preview_assets, segment_paths, output_path)
+
+    return {
+        "video_path": output_path,
+        "segments": len(sentences),
+        "rendered_segments": rendered,
+        **previews
+    }
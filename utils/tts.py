@@ -1,15 +1,17 @@
 import os
 import asyncio
-import edge_tts
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+# edge_tts is imported on first use to keep server startup cheap
+
 async def generate_speech_async(text, voice="en-US-AriaNeural"):
     """
     Generate speech from text using Edge TTS
     """
+    import edge_tts
     try:
         # Create output directory if it doesn't exist
         os.makedirs("static/audio", exist_ok=True)
@@ -39,6 +41,7 @@ def list_available_voices():
     """
     List all available voices from Edge TTS
     """
+    import edge_tts
     try:
         voices = asyncio.run(edge_tts.list_voices())
         return voices
@@ -2,158 +2,251 @@ import os
 import logging
 import uuid
 import subprocess
-import tempfile
 import shutil
-import cv2
-import numpy as np
 
 logger = logging.getLogger(__name__)
 
-def process_video(lip_sync_path, avatar_id):
+# cv2 and numpy are imported inside the functions that use them, so that
+# importing this module at server startup stays cheap (see utils/warmup.py)
+
+# Preview images written next to each rendered video: a poster frame and a
+# horizontal strip of small thumbnails for scrubbing
+PREVIEW_STRIP_FRAMES = 10
+PREVIEW_THUMB_WIDTH = 160
+
+# Where in the clip the poster frame is taken, as a fraction of its length;
+# the first frames are often mid-blink or mouth-closed
+POSTER_POSITION = 0.3
+
+class VideoProcessingError(Exception):
+    """
+    Raised when a video could not be rendered
+    
+    error_data is a JSON-serializable dict with the status, the avatar ID
+    and the error message, suitable for sending to the client as-is.
     """
-    Process the lip-synced video by adding expressions, gestures, and enhancements
+    
+    def __init__(self, error_data):
+        super().__init__(error_data["message"])
+        self.error_data = error_data
+    
+    def __reduce__(self):
+        # Rebuild from error_data when sent back from a render process
+        return (self.__class__, (self.error_data,))
+
+def render_avatar_video(audio_path, avatar_id):
+    """
+    Render the lip-synced, processed video for an audio track in one pass
+    
+    Equivalent to generate_lip_sync followed by adding expressions to the
+    lip sync video, without the intermediate video: the lip sync renderer and the expressions stage run
+    in their own processes and hand frames over shared memory (see
+    utils/frame_transport.py), and this process pipes them as raw video into
+    a single encode with the audio. No frame is written to or read back from
+    disk. The poster and strip are captured on the way to the encoder.
     
     Parameters:
-    - lip_sync_path: Path to the lip-synced video
+    - audio_path: Path to the speech audio
     - avatar_id: ID of the selected avatar
     
     Returns:
-    - Path to the final processed video
+    - Path to the final video
+    
+    Raises:
+    - VideoProcessingError if rendering failed; nothing is left at the
+      output path
     """
-    # Generate unique identifier for this job
+    from utils.frame_transport import render_lip_sync_frames
+    from utils.lip_sync import resolve_avatar_frame_path, get_avatar_frame, LIP_SYNC_FRAME_COUNT, LIP_SYNC_FPS
+    
     job_id = str(uuid.uuid4())
     output_path = f"static/videos/final/avatar_video_{job_id}.mp4"
+    encoder = None
     
     try:
-        # Create output directory if it doesn't exist
         os.makedirs("static/videos/final", exist_ok=True)
         
-        logger.debug(f"Processing video for avatar {avatar_id}")
+        avatar_frame = get_avatar_frame(resolve_avatar_frame_path(avatar_id))
+        height, width = avatar_frame.shape[:2]
         
-        # Check if input file exists
-        if not os.path.exists(lip_sync_path):
-            logger.error(f"Input lip sync video not found: {lip_sync_path}")
-            
-            # Create an error video instead
-            create_error_video(output_path, avatar_id, f"Input video not found: {lip_sync_path}")
-            return output_path
+        encode_cmd = [
+            "ffmpeg",
+            "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}",
+            "-framerate", str(LIP_SYNC_FPS),
+            "-i", "-",
+            "-i", audio_path,
+            "-c:v", "libx264",
+            "-preset", "fast",
+            "-crf", "22",
+            "-c:a", "aac",
+            "-pix_fmt", "yuv420p",
+            "-shortest",
+            output_path
+        ]
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
         
-        # In a real implementation, this would add expressions, gestures, etc.
-        # For this implementation, we'll simulate the process
+        poster_index = int(LIP_SYNC_FRAME_COUNT * POSTER_POSITION)
+        strip_indices = preview_strip_indices(LIP_SYNC_FRAME_COUNT)
+        previews = {"poster": None, "thumbnails": []}
         
-        # Simulate video processing (placeholder for actual implementation)
-        add_expressions_and_gestures(lip_sync_path, output_path, avatar_id)
+        def consume_frame(frame, i):
+            # The slot is reused once this returns, so keep copies only
+            encoder.stdin.write(frame.data)
+            if i == poster_index:
+                previews["poster"] = frame.copy()
+            if i in strip_indices:
+                previews["thumbnails"].append(make_thumbnail(frame))
         
-        logger.debug(f"Video processing completed. Output: {output_path}")
+        render_lip_sync_frames(avatar_frame, LIP_SYNC_FRAME_COUNT, consume_frame)
+        
+        _, stderr = encoder.communicate()
+        if encoder.returncode != 0:
+            raise subprocess.CalledProcessError(encoder.returncode, encode_cmd, stderr=stderr)
+        
+        if previews["poster"] is not None:
+            write_preview_assets(output_path, previews["poster"], previews["thumbnails"])
+        
+        logger.debug(f"Avatar video rendered. Output: {output_path}")
         
         return output_path
     
     except Exception as e:
-        logger.error(f"Error in video processing: {e}")
+        message = str(e)
+        # If the encoder died first, feeding it fails with a broken pipe;
+        # its own error says why
+        if encoder is not None and encoder.poll():
+            stderr = e.stderr if isinstance(e, subprocess.CalledProcessError) else encoder.communicate()[1]
+            if stderr:
+                logger.error(f"Failed to encode avatar video: {stderr.decode(errors='replace')}")
+                message = f"Encoder failed: {stderr.decode(errors='replace').strip().splitlines()[-1]}"
+        logger.error(f"Error rendering avatar video: {message}")
         
-        try:
-            # Create an error video instead
-            create_error_video(output_path, avatar_id, f"Error: {str(e)}")
-            return output_path
-        except Exception as inner_e:
-            logger.error(f"Failed to create error video: {inner_e}")
-            raise e
+        raise VideoProcessingError({
+            "status": "error",
+            "avatar_id": avatar_id,
+            "message": message
+        }) from e
+    
+    finally:
+        if encoder is not None and encoder.poll() is None:
+            encoder.kill()
+            encoder.wait()
+        # Never leave a partial video behind
+        if encoder is not None and encoder.returncode != 0 and os.path.exists(output_path):
+            os.remove(output_path)
+
+def preview_asset_paths(video_path):
+    """
+    Return the paths of the preview images that belong to a video
+    
+    Parameters:
+    - video_path: Path to the .mp4 video
+    
+    Returns:
+    - Dict with poster_path, poster_webp_path and strip_path
+    """
+    base = os.path.splitext(video_path)[0]
+    return {
+        "poster_path": f"{base}_poster.jpg",
+        "poster_webp_path": f"{base}_poster.webp",
+        "strip_path": f"{base}_strip.jpg"
+    }
+
+def existing_preview_assets(video_path):
+    """
+    Return preview_asset_paths for a video, with None for images that were not written
+    """
+    return {key: path if os.path.exists(path) else None
+            for key, path in preview_asset_paths(video_path).items()}
+
+def preview_strip_indices(frame_count, tile_count=PREVIEW_STRIP_FRAMES):
+    """
+    Pick evenly spaced indices, one per strip tile, out of frame_count items
+    """
+    if frame_count <= 0:
+        return []
+    tile_count = min(tile_count, frame_count)
+    return sorted({int((k + 0.5) * frame_count / tile_count) for k in range(tile_count)})
+
+def make_thumbnail(frame, width=PREVIEW_THUMB_WIDTH):
+    """
+    Scale a frame down to a strip thumbnail, keeping its aspect ratio
+    """
+    import cv2
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
 
-def add_expressions_and_gestures(input_video_path, output_path, avatar_id):
+def write_preview_assets(video_path, poster_frame, thumbnails):
     """
-    Add expressions and gestures to the lip-synced video
+    Write the poster (JPEG and WebP) and thumbnail strip for a video
     
-    In a real implementation, this would add various expressions and hand gestures
-    based on the content of the speech and the selected avatar.
+    Parameters:
+    - video_path: Path to the video the previews belong to
+    - poster_frame: Full size frame used as the poster
+    - thumbnails: Equally sized thumbnails, in playback order
+    
+    Returns:
+    - Dict of preview image paths, see preview_asset_paths
     """
+    import cv2
+    import numpy as np
+    paths = preview_asset_paths(video_path)
+    
     try:
-        # Create a temporary directory for processing
-        temp_dir = tempfile.mkdtemp(dir="temp")
-        frames_dir = os.path.join(temp_dir, "frames")
-        os.makedirs(frames_dir, exist_ok=True)
-        
-        # Extract frames from the input video
-        extract_cmd = [
-            "ffmpeg",
-            "-i", input_video_path,
-            "-vf", "fps=30",
-            os.path.join(frames_dir, "frame_%04d.jpg")
-        ]
-        
-        try:
-            subprocess.run(extract_cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to extract frames: {e.stderr.decode()}")
-            # Fallback to creating a simpler video if ffmpeg extraction fails
-            create_fallback_frames(frames_dir, avatar_id)
-        
-        # Get the audio from the input video
-        audio_path = os.path.join(temp_dir, "audio.aac")
-        extract_audio_cmd = [
-            "ffmpeg",
-            "-i", input_video_path,
-            "-vn",
-            "-acodec", "copy",
-            audio_path
-        ]
-        
-        try:
-            subprocess.run(extract_audio_cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to extract audio: {e.stderr.decode()}")
-            # Create a silent audio track as fallback
-            create_silent_audio(audio_path)
-        
-        # Process the frames to add expressions and gestures
-        processed_frames_dir = os.path.join(temp_dir, "processed_frames")
-        os.makedirs(processed_frames_dir, exist_ok=True)
-        
-        # Get list of frames
-        frames = sorted([f for f in os.listdir(frames_dir) if f.startswith("frame_")])
-        
-        # Process each frame
-        for i, frame_name in enumerate(frames):
-            frame_path = os.path.join(frames_dir, frame_name)
-            output_frame_path = os.path.join(processed_frames_dir, frame_name)
-            
-            # Read the frame
-            frame = cv2.imread(frame_path)
-            
-            if frame is not None:
-                # Apply expressions and gestures based on frame index
-                processed_frame = apply_expressions_and_gestures(frame, i, len(frames))
-                
-                # Save the processed frame
-                cv2.imwrite(output_frame_path, processed_frame)
-            else:
-                logger.warning(f"Failed to read frame: {frame_path}")
-        
-        # Combine the processed frames and audio to create the final video
-        combine_cmd = [
-            "ffmpeg",
-            "-y",
-            "-i", os.path.join(processed_frames_dir, "frame_%04d.jpg"),
-            "-i", audio_path,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "22",
-            "-c:a", "aac",
-            "-pix_fmt", "yuv420p",
-            "-shortest",
-            output_path
-        ]
-        
-        try:
-            subprocess.run(combine_cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to combine frames and audio: {e.stderr.decode()}")
+        cv2.imwrite(paths["poster_path"], poster_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        cv2.imwrite(paths["poster_webp_path"], poster_frame, [cv2.IMWRITE_WEBP_QUALITY, 80])
+        if thumbnails:
+            cv2.imwrite(paths["strip_path"], np.hstack(thumbnails), [cv2.IMWRITE_JPEG_QUALITY, 80])
+    except Exception as e:
+        # Previews are a nicety; never fail the render over them
+        logger.warning(f"Failed to write preview images for {video_path}: {e}")
+    
+    return existing_preview_assets(video_path)
+
+def combine_preview_assets(segment_paths, output_path):
+    """
+    Build the previews of a stitched video from the previews of its segments
+    
+    The poster is the first segment's poster and the strip is resampled from
+    the segment strips, so no video is decoded. This reads and writes
+    images, so run it through run_in_process from the web process.
+    
+    Parameters:
+    - segment_paths: Segment videos, in playback order
+    - output_path: Path of the stitched video
+    
+    Returns:
+    - Dict of preview image paths, with None for any that are unavailable
+    """
+    import cv2
+    import numpy as np
+    paths = preview_asset_paths(output_path)
+    
+    try:
+        first = preview_asset_paths(segment_paths[0])
+        for key in ("poster_path", "poster_webp_path"):
+            if os.path.exists(first[key]):
+                shutil.copyfile(first[key], paths[key])
         
-        # Clean up temporary directory
-        shutil.rmtree(temp_dir)
+        # Cut each segment strip back into its thumbnails
+        tiles = []
+        for segment_path in segment_paths:
+            strip = cv2.imread(preview_asset_paths(segment_path)["strip_path"])
+            if strip is None or strip.shape[1] % PREVIEW_THUMB_WIDTH:
+                continue
+            tiles.extend(np.split(strip, strip.shape[1] // PREVIEW_THUMB_WIDTH, axis=1))
         
+        if tiles and len({tile.shape for tile in tiles}) == 1:
+            picked = [tiles[i] for i in preview_strip_indices(len(tiles))]
+            cv2.imwrite(paths["strip_path"], np.hstack(picked), [cv2.IMWRITE_JPEG_QUALITY, 80])
     except Exception as e:
-        logger.error(f"Error in add_expressions_and_gestures: {e}")
-        raise
+        logger.warning(f"Failed to combine preview images for {output_path}: {e}")
+    
+    return existing_preview_assets(output_path)
 
 def apply_expressions_and_gestures(frame, frame_index, total_frames):
     """
@@ -167,6 +260,8 @@ def apply_expressions_and_gestures(frame, frame_index, total_frames):
     Returns:
     - The processed frame with expressions and gestures
     """
+    import cv2
+    import numpy as np
     try:
         # Make a copy of the frame
         processed_frame = frame.copy()
@@ -220,195 +315,3 @@ def apply_expressions_and_gestures(frame, frame_index, total_frames):
         logger.error(f"Error applying expressions and gestures: {e}")
         # Return original frame if processing fails
         return frame
-
-def create_fallback_frames(frames_dir, avatar_id):
-    """
-    Create fallback frames if frame extraction fails
-    """
-    try:
-        # Create 90 frames (3 seconds at 30fps)
-        for i in range(90):
-            # Create a blank frame
-            frame = np.ones((480, 640, 3), dtype=np.uint8) * 255
-            
-            # Add text to the frame
-            cv2.putText(
-                frame, 
-                f"Avatar {avatar_id}", 
-                (50, 100), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                1, 
-                (0, 0, 0), 
-                2
-            )
-            
-            cv2.putText(
-                frame, 
-                "Animated Speech", 
-                (50, 200), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                1, 
-                (0, 0, 0), 
-                2
-            )
-            
-            # Add animated element based on frame index
-            animation_pos = int(50 + 150 * (0.5 + 0.5 * np.sin(i * 0.1)))
-            cv2.circle(frame, (animation_pos, 300), 30, (0, 0, 255), -1)
-            
-            # Save the frame
-            frame_path = os.path.join(frames_dir, f"frame_{i:04d}.jpg")
-            cv2.imwrite(frame_path, frame)
-    
-    except Exception as e:
-        logger.error(f"Error creating fallback frames: {e}")
-        raise
-
-def create_silent_audio(audio_path):
-    """
-    Create a silent audio track as fallback
-    """
-    try:
-        # Create a 3-second silent audio track
-        silence_cmd = [
-            "ffmpeg",
-            "-y",
-            "-f", "lavfi",
-            "-i", "anullsrc=r=44100:cl=stereo",
-            "-t", "3",
-            audio_path
-        ]
-        
-        subprocess.run(silence_cmd, check=True, capture_output=True)
-    
-    except Exception as e:
-        logger.error(f"Error creating silent audio: {e}")
-        raise
-
-def create_error_video(output_path, avatar_id, error_message):
-    """
-    Create a video with an error message when processing fails
-    
-    Parameters:
-    - output_path: Path where the output video should be saved
-    - avatar_id: ID of the avatar that was being processed
-    - error_message: The error message to display
-    """
-    logger.debug(f"Creating error video for avatar {avatar_id} at {output_path}")
-    
-    try:
-        # Create a temporary directory for processing
-        temp_dir = tempfile.mkdtemp(dir="temp")
-        frames_dir = os.path.join(temp_dir, "frames")
-        os.makedirs(frames_dir, exist_ok=True)
-        
-        # Create 90 frames (3 seconds at 30fps)
-        for i in range(90):
-            # Create a frame with error message
-            frame = np.ones((480, 640, 3), dtype=np.uint8) * 255  # White background
-            
-            # Draw a red border
-            cv2.rectangle(frame, (20, 20), (620, 460), (0, 0, 200), 10)
-            
-            # Add avatar ID
-            cv2.putText(
-                frame, 
-                f"Avatar: {avatar_id}", 
-                (50, 80), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.8, 
-                (0, 0, 0), 
-                2
-            )
-            
-            # Add error title
-            cv2.putText(
-                frame, 
-                "Error Generating Video", 
-                (50, 150), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                1.2, 
-                (200, 0, 0), 
-                2
-            )
-            
-            # Add error message (may need to break into multiple lines)
-            error_lines = []
-            words = error_message.split()
-            current_line = ""
-            
-            for word in words:
-                test_line = current_line + " " + word if current_line else word
-                if len(test_line) < 40:  # Max chars per line
-                    current_line = test_line
-                else:
-                    error_lines.append(current_line)
-                    current_line = word
-            
-            if current_line:
-                error_lines.append(current_line)
-            
-            # Draw each line of the error message
-            y_position = 200
-            for line in error_lines:
-                cv2.putText(
-                    frame, 
-                    line, 
-                    (50, y_position), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 
-                    0.8, 
-                    (0, 0, 0), 
-                    1
-                )
-                y_position += 40
-            
-            # Add a pulsing "error" indicator
-            pulse_size = int(30 + 10 * np.sin(i * 0.2))
-            cv2.circle(frame, (320, 350), pulse_size, (0, 0, 200), -1)
-            
-            # Save the frame
-            frame_path = os.path.join(frames_dir, f"frame_{i:04d}.jpg")
-            cv2.imwrite(frame_path, frame)
-        
-        # Create a silent audio track
-        audio_path = os.path.join(temp_dir, "silent.aac")
-        create_silent_audio(audio_path)
-        
-        # Combine frames and audio into a video
-        ffmpeg_cmd = [
-            "ffmpeg",
-            "-y",
-            "-i", os.path.join(frames_dir, "frame_%04d.jpg"),
-            "-i", audio_path,
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "22",
-            "-c:a", "aac",
-            "-pix_fmt", "yuv420p",
-            "-shortest",
-            output_path
-        ]
-        
-        try:
-            # Try to run ffmpeg
-            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-            logger.debug("Error video created successfully")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFMPEG error while creating error video: {e.stderr.decode()}")
-            
-            # Create a text file with the error if video creation fails
-            with open(output_path.replace(".mp4", ".txt"), "w") as f:
-                f.write(f"Error creating video: {e}\n\nOriginal error: {error_message}")
-        
-        # Clean up temporary directory
-        shutil.rmtree(temp_dir)
-    
-    except Exception as e:
-        logger.error(f"Error in create_error_video: {e}")
-        # Create a simple text file as a last resort
-        try:
-            with open(output_path.replace(".mp4", ".txt"), "w") as f:
-                f.write(f"Critical error creating video: {e}\n\nOriginal error: {error_message}")
-        except:
-            pass
-        raise
@@ -0,0 +1,68 @@
+import json
+import time
+import logging
+from functools import partial
+from utils.lip_sync import resolve_avatar_frame_path, get_avatar_frame
+from utils.offload import is_async_mode, start_process_pool
+
+logger = logging.getLogger(__name__)
+
+def import_render_modules():
+    """
+    Import the heavy modules the render stages need (OpenCV, NumPy, Edge TTS)
+    """
+    import cv2
+    import numpy
+    import edge_tts
+
+def load_avatar_ids(avatar_data_path="static/avatars/avatar-data.json"):
+    with open(avatar_data_path) as f:
+        return [avatar["id"] for avatar in json.load(f)["avatars"]]
+
+def warm_up_render_process(avatar_ids=None):
+    """
+    Import the render modules and decode every avatar frame in this process
+
+    Submitted to each render pool process in async mode, since that is where
+    the frames are drawn.
+    """
+    import_render_modules()
+    _preload_avatars(avatar_ids)
+
+def warm_up(avatar_ids=None):
+    """
+    Pay one-off startup costs before the first request instead of during it
+
+    Imports the render modules and decodes every avatar frame into the
+    frame cache. In async mode renders run in the process pool, so the pool
+    is started and each pool process does the decoding instead; nothing
+    CPU-heavy runs on the event loop. Call this once per worker process
+    after it starts; a failing step is logged and skipped.
+
+    Parameters:
+    - avatar_ids: Avatars to preload; defaults to every avatar in avatar-data.json
+    """
+    start = time.perf_counter()
+
+    if is_async_mode():
+        steps = [
+            ("import render modules", import_render_modules),
+            ("start render process pool", lambda: start_process_pool(partial(warm_up_render_process, avatar_ids))),
+        ]
+    else:
+        steps = [
+            ("import render modules", import_render_modules),
+            ("preload avatars", lambda: _preload_avatars(avatar_ids)),
+        ]
+
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {e}")
+
+    logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+def _preload_avatars(avatar_ids):
+    for avatar_id in avatar_ids or load_avatar_ids():
+        get_avatar_frame(resolve_avatar_frame_path(avatar_id))
@@ -0,0 +1,158 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.jobs import run_export_job, run_preview_job
+from utils.batch import run_batch_job
+from utils.broker import JOB_LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Each handler takes (payload, send, submit); submit is only used by batches
+JOB_HANDLERS = {
+    'export': lambda payload, send, submit: run_export_job(payload['text'], payload['avatar_id'], payload['voice'], send),
+    'preview': lambda payload, send, submit: run_preview_job(payload['text'], payload['avatar_id'], payload['voice'], send),
+    'batch': lambda payload, send, submit: run_batch_job(payload['batch_id'], payload['items'], send, submit=submit, make_zip=payload.get('zip', False)),
+}
+
+class RenderSlots:
+    """
+    The render slots of one worker process
+
+    Claimed jobs and the segments of running batches take a slot each, so a
+    worker never renders more than its concurrency at once. Waiting batch
+    segments are given free slots before new jobs are claimed.
+    """
+
+    def __init__(self, count):
+        self._condition = threading.Condition()
+        self._free = count
+        self._waiting_segments = 0
+
+    def acquire_for_claim(self, timeout):
+        """
+        Take a slot to claim a job with, waiting up to timeout seconds
+
+        Returns:
+        - True if a slot was taken
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._free and not self._waiting_segments, timeout) and self._take()
+
+    def acquire_for_segment(self):
+        """
+        Take a slot for a batch segment, waiting as long as needed
+        """
+        with self._condition:
+            self._waiting_segments += 1
+            try:
+                self._condition.wait_for(lambda: self._free)
+            finally:
+                self._waiting_segments -= 1
+            self._take()
+
+    def _take(self):
+        self._free -= 1
+        return True
+
+    def release(self):
+        with self._condition:
+            self._free += 1
+            self._condition.notify_all()
+
+def execute_job(broker, job_id, payload, submit=None):
+    """
+    Run one claimed job, publishing its progress to the client's room
+
+    The job's lease is renewed in the background while it runs, so only a
+    job whose worker died is handed to another worker.
+
+    Parameters:
+    - broker: The ProgressBroker the job was claimed from
+    - job_id: ID of the claimed job
+    - payload: The job payload
+    - submit: Optional callable taking (fn, cost) and returning a Future,
+      used by batch jobs to run their segments
+    """
+    room = payload.get('room')
+
+    def send(event, data):
+        broker.publish(room, event, data)
+
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                broker.renew_job(job_id)
+            except Exception as e:
+                logger.warning(f"Failed to renew lease on job {job_id}: {e}")
+
+    threading.Thread(target=heartbeat, name=f"lease-{job_id}", daemon=True).start()
+
+    try:
+        handler = JOB_HANDLERS[payload['kind']]
+        handler(payload, send, submit)
+    except Exception as e:
+        # Job bodies report their own failures to the client
+        logger.error(f"Job {job_id} failed: {e}")
+    finally:
+        done.set()
+        broker.complete_job(job_id)
+
+def run_worker(broker, concurrency=2, stop_event=None):
+    """
+    Claim and run jobs from the broker until stopped
+
+    A batch is claimed as one job, so it counts once toward the broker's
+    per-client cap and runs entirely in this worker. While it runs it gives
+    up its own slot and each of its segments takes one instead, so batches
+    share the worker's concurrency with the other jobs it has claimed
+    rather than adding threads of their own.
+
+    Parameters:
+    - broker: The ProgressBroker shared with the web processes
+    - concurrency: Number of jobs and batch segments rendered at the same time
+    - stop_event: Optional threading.Event that stops the worker when set
+    """
+    stop_event = stop_event or threading.Event()
+    slots = RenderSlots(concurrency)
+    segment_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-segment")
+
+    def run_segment(fn):
+        slots.acquire_for_segment()
+        try:
+            return fn()
+        finally:
+            slots.release()
+
+    def submit_segment(fn, cost):
+        return segment_executor.submit(run_segment, fn)
+
+    def worker_loop():
+        while not stop_event.is_set():
+            if not slots.acquire_for_claim(timeout=1.0):
+                continue
+            claimed = broker.claim_job()
+            if claimed is None:
+                slots.release()
+                continue
+            job_id, payload = claimed
+            logger.info(f"Running {payload['kind']} job {job_id}")
+            if payload['kind'] == 'batch':
+                slots.release()
+                execute_job(broker, job_id, payload, submit=submit_segment)
+            else:
+                try:
+                    execute_job(broker, job_id, payload)
+                finally:
+                    slots.release()
+
+    threads = [
+        threading.Thread(target=worker_loop, name=f"job-worker-{i}", daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    segment_executor.shutdown(wait=False)